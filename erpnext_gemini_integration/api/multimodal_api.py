@@ -10,7 +10,7 @@ from ..gemini.client import GeminiClient
 from ..gemini.prompt_builder import PromptBuilder
 from ..gemini.response_parser import ResponseParser
 from ..utils.context_manager import ContextManager
-from ..utils.file_processor import FileProcessor
+from ..utils.file_processor import get_file_processor
 from ..gemini.exceptions import GeminiAPIError, GeminiFileProcessingError
 
 @frappe.whitelist()
@@ -45,7 +45,7 @@ def process_multimodal_request(conversation_id=None, message=None, file_url=None
         client = GeminiClient()
         prompt_builder = PromptBuilder()
         response_parser = ResponseParser()
-        file_processor = FileProcessor()
+        file_processor = get_file_processor()
         
         # Get or create conversation
         from erpnext_gemini_integration.api.chat_api import get_or_create_conversation, save_message, get_conversation_history
@@ -193,7 +193,7 @@ def process_document(doctype, docname, field=None, attachment_name=None):
     """
     try:
         # Initialize file processor
-        file_processor = FileProcessor()
+        file_processor = get_file_processor()
         
         # Process attachment
         result = file_processor.process_attachment(doctype, docname, field, attachment_name)
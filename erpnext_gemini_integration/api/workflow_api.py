@@ -82,7 +82,7 @@ def execute_custom_action(action_name, params=None):
         return {"success": False, "error": str(e)}
 
 @frappe.whitelist()
-def get_ai_recommendation(doctype, docname, context=None):
+def get_ai_recommendation(doctype, docname, context=None, stream=0):
     """
     Get AI recommendations for a document.
     
@@ -90,6 +90,8 @@ def get_ai_recommendation(doctype, docname, context=None):
         doctype (str): DocType of the document
         docname (str): Name of the document
         context (dict or str, optional): Additional context
+        stream (int, optional): Also publish the recommendation as realtime
+            chunks while it is generated
         
     Returns:
         dict: AI recommendations
@@ -106,7 +108,7 @@ def get_ai_recommendation(doctype, docname, context=None):
         workflow_engine = WorkflowEngine()
         
         # Get recommendations
-        result = workflow_engine.get_ai_recommendation(doctype, docname, context)
+        result = workflow_engine.get_ai_recommendation(doctype, docname, context, stream=cint(stream))
         
         return result
         
@@ -114,6 +116,48 @@ def get_ai_recommendation(doctype, docname, context=None):
         frappe.log_error(f"Error getting AI recommendation: {str(e)}")
         return {"success": False, "error": str(e)}
 
+@frappe.whitelist()
+def get_ai_recommendations_bulk(items, context=None):
+    """
+    Get AI recommendations for several documents in batched prompts.
+    
+    Args:
+        items (list or str): List of dicts with "doctype" and "docname"
+        context (dict or str, optional): Additional context
+        
+    Returns:
+        dict: Per-document AI recommendations
+    """
+    try:
+        # Parse items if provided as string
+        if isinstance(items, str):
+            try:
+                items = json.loads(items)
+            except Exception:
+                return {
+                    "success": False,
+                    "error": "Invalid items format"
+                }
+        
+        # Parse context if provided as string
+        if context and isinstance(context, str):
+            try:
+                context = json.loads(context)
+            except Exception:
+                context = {}
+        
+        # Initialize workflow engine
+        workflow_engine = WorkflowEngine()
+        
+        # Get recommendations
+        result = workflow_engine.get_ai_recommendations_bulk(items, context)
+        
+        return result
+        
+    except Exception as e:
+        frappe.log_error(f"Error getting bulk AI recommendations: {str(e)}")
+        return {"success": False, "error": str(e)}
+
 @frappe.whitelist()
 def get_available_actions(doctype=None, user=None):
     """
@@ -1,7 +1,12 @@
 import frappe
 from frappe.model.document import Document
+from erpnext_gemini_integration.utils.security import clear_request_security_manager
 
 class GeminiAssistantSettings(Document):
     def validate(self):
         # Add validation logic here if needed
         pass
+    
+    def on_update(self):
+        # Masking settings changed; stop reusing this request's SecurityManager
+        clear_request_security_manager()
@@ -24,4 +24,8 @@ class GeminiMessage(Document):
     #         if kw.keyword.lower() in self.message.lower():
     #             frappe.throw(
     #                 f"Message contains sensitive keyword: {kw.keyword}. Please revise your message."
-    #             ) 
\ No newline at end of file
+    #             )
+
+def on_doctype_update():
+    # History is always fetched per conversation ordered by timestamp
+    frappe.db.add_index("Gemini Message", ["conversation", "timestamp"])
@@ -1,5 +1,6 @@
 import frappe
 from frappe.model.document import Document
+from erpnext_gemini_integration.utils.security import clear_sensitive_keywords_cache
 
 class GeminiSensitiveKeyword(Document):
     def validate(self):
@@ -8,4 +9,10 @@ class GeminiSensitiveKeyword(Document):
             frappe.throw('Keyword cannot be empty')
             
         # Convert to lowercase for consistency
-        self.keyword = self.keyword.strip().lower() 
\ No newline at end of file
+        self.keyword = self.keyword.strip().lower()
+    
+    def on_update(self):
+        clear_sensitive_keywords_cache()
+    
+    def on_trash(self):
+        clear_sensitive_keywords_cache()
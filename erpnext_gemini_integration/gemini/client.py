@@ -10,7 +10,11 @@ import base64
 from frappe import _
 from frappe.utils import now_datetime
 from ..utils.security import mask_sensitive_data
-from .exceptions import GeminiAPIError, GeminiRateLimitError, GeminiAuthError
+from .exceptions import GeminiAPIError, GeminiError, GeminiRateLimitError, GeminiAuthError
+
+# Connect and per-read timeouts for streamed responses; the read timeout
+# bounds the wait for each event, not the whole generation
+_STREAM_TIMEOUT = (10, 60)
 
 class GeminiClient:
     """
@@ -22,7 +26,7 @@ class GeminiClient:
     
     def __init__(self):
         """Initialize the Gemini client with settings from the database."""
-        self.settings = frappe.get_single("Gemini Assistant Settings")
+        self.settings = frappe.get_cached_doc("Gemini Assistant Settings")
         self.api_key = self.get_api_key()
         self.default_model = self.settings.default_model
         self.rate_limit = self.settings.rate_limits
@@ -73,22 +77,10 @@ class GeminiClient:
             print(f"API URL prepared")
             
             # Prepare request payload
-            payload = {
-                "contents": [{
-                    "parts": [{
-                        "text": masked_prompt
-                    }]
-                }],
-                "generationConfig": {
-                    "temperature": temperature,
-                }
-            }
-            
-            if max_tokens:
-                payload["generationConfig"]["maxOutputTokens"] = max_tokens
-                
-            if safety_settings:
-                payload["safetySettings"] = safety_settings
+            payload = self._build_payload(
+                [{"parts": [{"text": masked_prompt}]}],
+                temperature, max_tokens, safety_settings
+            )
             
             # Log the request in audit log
             request_id = self._log_request(masked_prompt, model_name)
@@ -117,15 +109,109 @@ class GeminiClient:
             return processed_response
             
         except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:
-                self._log_error(request_id, str(e), "rate_limit")
-                raise GeminiRateLimitError(f"Rate limit exceeded: {str(e)}")
-            elif e.response.status_code in (401, 403):
-                self._log_error(request_id, str(e), "auth")
-                raise GeminiAuthError(f"Authentication error: {str(e)}")
-            else:
-                self._log_error(request_id, str(e), "general")
-                raise GeminiAPIError(f"HTTP error: {str(e)}")
+            self._raise_http_error(request_id, e)
+        except Exception as e:
+            self._log_error(request_id, str(e), "general")
+            raise GeminiAPIError(f"Error generating content: {str(e)}")
+    
+    def generate_text_stream(self, prompt, on_chunk, model=None, safety_settings=None, temperature=0.7, max_tokens=None):
+        """
+        Generate a text response from Gemini API, streaming it as it is produced.
+        
+        Uses the streamGenerateContent endpoint with server-sent events and
+        hands each text fragment to on_chunk as soon as it arrives, so callers
+        can show partial output before generation finishes.
+        
+        Args:
+            prompt (str): The prompt to send to Gemini
+            on_chunk (callable): Called with each text fragment
+            model (str, optional): Model to use. Defaults to the configured default model.
+            safety_settings (dict, optional): Safety settings for content filtering
+            temperature (float, optional): Creativity level. Defaults to 0.7.
+            max_tokens (int, optional): Maximum tokens in response
+            
+        Returns:
+            dict: Processed response with the full text, as from generate_text
+            
+        Raises:
+            GeminiAPIError: For general API errors
+            GeminiRateLimitError: When rate limits are exceeded
+            GeminiAuthError: For authentication issues
+        """
+        request_id = None
+        
+        try:
+            # Mask sensitive data in prompt
+            masked_prompt = mask_sensitive_data(prompt)
+            
+            # Use default model if not specified
+            model_name = model or self.default_model
+            
+            # Prepare API URL
+            api_url = f"{self.api_base_url}/{model_name}:streamGenerateContent?alt=sse&key={self.api_key}"
+            
+            # Prepare request payload
+            payload = self._build_payload(
+                [{"parts": [{"text": masked_prompt}]}],
+                temperature, max_tokens, safety_settings
+            )
+            
+            # Log the request in audit log
+            request_id = self._log_request(masked_prompt, model_name)
+            
+            # Make API call
+            response = requests.post(
+                api_url,
+                headers={'Content-Type': 'application/json'},
+                json=payload,
+                stream=True,
+                timeout=_STREAM_TIMEOUT
+            )
+            
+            # Check for HTTP errors
+            response.raise_for_status()
+            
+            text_parts = []
+            last_event = {}
+            
+            # Each SSE event carries a partial GenerateContentResponse
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                
+                event = json.loads(line[5:])
+                
+                if 'error' in event:
+                    raise GeminiAPIError(event['error'].get('message', 'Unknown error'))
+                
+                last_event = event
+                
+                for candidate in event.get('candidates', [])[:1]:
+                    for part in candidate.get('content', {}).get('parts', []):
+                        chunk = part.get('text')
+                        if chunk:
+                            text_parts.append(chunk)
+                            on_chunk(chunk)
+            
+            # The final event carries the usage metadata and finish reason
+            candidates = last_event.get('candidates') or [{}]
+            processed_response = {
+                "text": "".join(text_parts),
+                "tokens_used": last_event.get('usageMetadata', {}).get('totalTokenCount', 0),
+                "model": last_event.get('modelVersion', 'unknown'),
+                "finish_reason": candidates[0].get('finishReason', 'unknown')
+            }
+            
+            self._log_response(request_id, processed_response)
+            
+            return processed_response
+            
+        except requests.exceptions.HTTPError as e:
+            self._raise_http_error(request_id, e)
+        except (GeminiAPIError, GeminiError) as e:
+            # Errors reported inside the stream are raised as they are
+            self._log_error(request_id, str(e), "general")
+            raise
         except Exception as e:
             self._log_error(request_id, str(e), "general")
             raise GeminiAPIError(f"Error generating content: {str(e)}")
@@ -179,18 +265,7 @@ class GeminiClient:
                             })
             
             # Prepare request payload
-            payload = {
-                "contents": content_parts,
-                "generationConfig": {
-                    "temperature": temperature
-                }
-            }
-            
-            if max_tokens:
-                payload["generationConfig"]["maxOutputTokens"] = max_tokens
-                
-            if safety_settings:
-                payload["safetySettings"] = safety_settings
+            payload = self._build_payload(content_parts, temperature, max_tokens, safety_settings)
             
             # Log the request
             request_id = self._log_request(masked_prompt, model_name, has_images=bool(images))
@@ -218,19 +293,62 @@ class GeminiClient:
             return processed_response
             
         except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:
-                self._log_error(request_id, str(e), "rate_limit")
-                raise GeminiRateLimitError(f"Rate limit exceeded: {str(e)}")
-            elif e.response.status_code in (401, 403):
-                self._log_error(request_id, str(e), "auth")
-                raise GeminiAuthError(f"Authentication error: {str(e)}")
-            else:
-                self._log_error(request_id, str(e), "general")
-                raise GeminiAPIError(f"HTTP error: {str(e)}")
+            self._raise_http_error(request_id, e)
         except Exception as e:
             self._log_error(request_id, str(e), "general")
             raise GeminiAPIError(f"Error generating content: {str(e)}")
     
+    def _build_payload(self, contents, temperature, max_tokens=None, safety_settings=None):
+        """
+        Build a generateContent request payload.
+        
+        Args:
+            contents (list): Content entries with their parts
+            temperature (float): Creativity level
+            max_tokens (int, optional): Maximum tokens in response
+            safety_settings (dict, optional): Safety settings for content filtering
+            
+        Returns:
+            dict: Request payload
+        """
+        payload = {
+            "contents": contents,
+            "generationConfig": {
+                "temperature": temperature
+            }
+        }
+        
+        if max_tokens:
+            payload["generationConfig"]["maxOutputTokens"] = max_tokens
+            
+        if safety_settings:
+            payload["safetySettings"] = safety_settings
+        
+        return payload
+    
+    def _raise_http_error(self, request_id, error):
+        """
+        Log an HTTP error from the Gemini API and raise the matching Gemini exception.
+        
+        Args:
+            request_id (str): Request ID from the audit log
+            error (requests.exceptions.HTTPError): Error raised by requests
+            
+        Raises:
+            GeminiRateLimitError: When rate limits are exceeded
+            GeminiAuthError: For authentication issues
+            GeminiAPIError: For any other HTTP error
+        """
+        if error.response.status_code == 429:
+            self._log_error(request_id, str(error), "rate_limit")
+            raise GeminiRateLimitError(f"Rate limit exceeded: {str(error)}")
+        elif error.response.status_code in (401, 403):
+            self._log_error(request_id, str(error), "auth")
+            raise GeminiAuthError(f"Authentication error: {str(error)}")
+        else:
+            self._log_error(request_id, str(error), "general")
+            raise GeminiAPIError(f"HTTP error: {str(error)}")
+    
     def _process_response(self, response):
         """
         Process the raw response from Gemini API.
@@ -4,9 +4,28 @@
 
 import frappe
 import json
+from functools import lru_cache
 from frappe import _
 from frappe.utils import now_datetime
 
+@lru_cache(maxsize=8)
+def _parse_prompt_templates(raw_templates):
+    """
+    Parse the default prompt templates JSON from settings.
+    
+    Memoized on the raw JSON string, so the templates are parsed once per
+    distinct value rather than on every PromptBuilder construction. Edits
+    to the setting produce a new string and therefore a fresh parse. The
+    returned dict is shared between callers and must not be mutated.
+    
+    Args:
+        raw_templates (str): Templates JSON from Gemini Assistant Settings
+        
+    Returns:
+        dict: Dictionary of template names and their content
+    """
+    return json.loads(raw_templates)
+
 class PromptBuilder:
     """
     Dynamic prompt builder for Gemini API requests.
@@ -18,7 +37,7 @@ class PromptBuilder:
     
     def __init__(self):
         """Initialize the prompt builder with settings from the database."""
-        self.settings = frappe.get_single("Gemini Assistant Settings")
+        self.settings = frappe.get_cached_doc("Gemini Assistant Settings")
         self.default_templates = self._load_default_templates()
     
     def _load_default_templates(self):
@@ -30,7 +49,7 @@ class PromptBuilder:
         """
         try:
             if self.settings.default_prompt_templates:
-                return json.loads(self.settings.default_prompt_templates)
+                return _parse_prompt_templates(self.settings.default_prompt_templates)
             return {}
         except Exception as e:
             frappe.log_error(f"Error loading prompt templates: {str(e)}")
@@ -3,11 +3,110 @@
 # For license information, please see license.txt
 
 import frappe
+import csv
 import json
 import re
+from functools import lru_cache
+from io import StringIO
 from frappe import _
 from frappe.utils import now_datetime
 
+# Patterns used by _extract_json/_extract_csv, compiled once at import time
+_JSON_BLOCK_RE = re.compile(r'```json\s*([\s\S]*?)\s*```')
+_JSON_OBJECT_RE = re.compile(r'(\{[\s\S]*\})')
+_CSV_BLOCK_RE = re.compile(r'```csv\s*([\s\S]*?)\s*```')
+
+# Action item patterns: bulleted/numbered lines and "Action:/TODO:/Task:"
+# headers. They are scanned in separate passes because a list item may
+# span lines and would otherwise swallow the newline a header needs.
+_ACTION_LIST_RE = re.compile(r'(?:^|\n)(?:\d+\.|\*|\-)\s+((?:[A-Z][a-z]+|[A-Z]+)(?:\s+[a-z]+)+)')
+_ACTION_HEADER_RE = re.compile(r'(?:^|\n)(?:Action|TODO|Task)(?:s)?(?:\:|\s+\-\s+)(.*?)(?:\n|$)', re.IGNORECASE)
+
+@lru_cache(maxsize=256)
+def _json_candidates(text):
+    """
+    Find the substrings of text that may hold JSON, in the order to try them.
+    
+    Memoized on the response text so the regex scans run once per response.
+    Only the matched strings are cached; they are immutable, so callers can
+    parse them freshly without copying a shared object.
+    
+    Args:
+        text (str): Text that may contain JSON
+        
+    Returns:
+        tuple: Candidate JSON strings, fenced block first
+    """
+    candidates = []
+    
+    # Only run the code-block regex when a ```json fence is present
+    if '```json' in text:
+        json_match = _JSON_BLOCK_RE.search(text)
+        
+        if json_match:
+            candidates.append(json_match.group(1))
+    
+    # No opening brace means there is no bare JSON object either
+    if '{' in text:
+        # Look for text that starts with { and ends with }
+        json_match = _JSON_OBJECT_RE.search(text)
+        
+        if json_match:
+            candidates.append(json_match.group(1))
+    
+    return tuple(candidates)
+
+def _extract_json(text):
+    """
+    Extract JSON data from text.
+    
+    Args:
+        text (str): Text that may contain JSON
+        
+    Returns:
+        dict or None: Extracted JSON data or None if not found
+    """
+    for candidate in _json_candidates(text):
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            pass
+    
+    return None
+
+@lru_cache(maxsize=256)
+def _extract_csv(text):
+    """
+    Extract CSV data from text.
+    
+    Memoized on the response text; rows are returned as tuples so the
+    cached value is immutable.
+    
+    Args:
+        text (str): Text that may contain CSV
+        
+    Returns:
+        tuple or None: Extracted CSV rows or None if not found
+    """
+    # Look for CSV pattern
+    csv_match = _CSV_BLOCK_RE.search(text)
+    
+    if csv_match:
+        csv_text = csv_match.group(1)
+    else:
+        # Try to find CSV-like content without code blocks
+        csv_lines = [line for line in text.split('\n') if ',' in line]
+        
+        if len(csv_lines) > 1:
+            csv_text = '\n'.join(csv_lines)
+        else:
+            return None
+    
+    # Parse CSV
+    csv_data = tuple(tuple(row) for row in csv.reader(StringIO(csv_text)))
+    
+    return csv_data if csv_data else None
+
 class ResponseParser:
     """
     Response parser for Gemini API responses.
@@ -31,6 +130,9 @@ class ResponseParser:
         Returns:
             dict: Parsed and formatted response
         """
+        # Read once; shared by the success and error results
+        tokens_used = response.get("tokens_used", 0)
+        
         try:
             # Extract the text content
             text = response.get("text", "")
@@ -47,7 +149,7 @@ class ResponseParser:
             parsed_response = {
                 "content": formatted_text,
                 "format": format_type,
-                "tokens_used": response.get("tokens_used", 0),
+                "tokens_used": tokens_used,
                 "success": True
             }
             
@@ -61,7 +163,7 @@ class ResponseParser:
             return {
                 "content": "Error parsing response",
                 "format": format_type,
-                "tokens_used": response.get("tokens_used", 0),
+                "tokens_used": tokens_used,
                 "success": False,
                 "error": str(e)
             }
@@ -77,6 +179,8 @@ class ResponseParser:
         Returns:
             dict: Extracted structured data
         """
+        tokens_used = response.get("tokens_used", 0)
+        
         try:
             # Extract the text content
             text = response.get("text", "")
@@ -87,7 +191,7 @@ class ResponseParser:
                 return {
                     "data": json_data,
                     "format": "json",
-                    "tokens_used": response.get("tokens_used", 0),
+                    "tokens_used": tokens_used,
                     "success": True
                 }
             
@@ -98,7 +202,7 @@ class ResponseParser:
                     return {
                         "data": csv_data,
                         "format": "csv",
-                        "tokens_used": response.get("tokens_used", 0),
+                        "tokens_used": tokens_used,
                         "success": True
                     }
             
@@ -106,7 +210,7 @@ class ResponseParser:
             return {
                 "data": text,
                 "format": "text",
-                "tokens_used": response.get("tokens_used", 0),
+                "tokens_used": tokens_used,
                 "success": True,
                 "note": "No structured data found in expected format"
             }
@@ -116,7 +220,7 @@ class ResponseParser:
             return {
                 "data": None,
                 "format": "unknown",
-                "tokens_used": response.get("tokens_used", 0),
+                "tokens_used": tokens_used,
                 "success": False,
                 "error": str(e)
             }
@@ -131,6 +235,8 @@ class ResponseParser:
         Returns:
             dict: Extracted action items
         """
+        tokens_used = response.get("tokens_used", 0)
+        
         try:
             # Extract the text content
             text = response.get("text", "")
@@ -139,26 +245,20 @@ class ResponseParser:
             actions = []
             
             # Pattern 1: Numbered or bulleted lists with action verbs
-            action_pattern = r'(?:^|\n)(?:\d+\.|\*|\-)\s+((?:[A-Z][a-z]+|[A-Z]+)(?:\s+[a-z]+)+)'
-            action_matches = re.findall(action_pattern, text)
-            
-            for match in action_matches:
+            for match in _ACTION_LIST_RE.findall(text):
                 # Check if it starts with an action verb
                 if self._is_action_verb(match.split()[0]):
                     actions.append(match.strip())
             
             # Pattern 2: Lines starting with "Action:" or similar
-            action_header_pattern = r'(?:^|\n)(?:Action|TODO|Task)(?:s)?(?:\:|\s+\-\s+)(.*?)(?:\n|$)'
-            action_header_matches = re.findall(action_header_pattern, text, re.IGNORECASE)
-            
-            for match in action_header_matches:
+            for match in _ACTION_HEADER_RE.findall(text):
                 actions.append(match.strip())
             
             # Return the extracted actions
             return {
                 "actions": actions,
                 "count": len(actions),
-                "tokens_used": response.get("tokens_used", 0),
+                "tokens_used": tokens_used,
                 "success": True
             }
             
@@ -167,7 +267,7 @@ class ResponseParser:
             return {
                 "actions": [],
                 "count": 0,
-                "tokens_used": response.get("tokens_used", 0),
+                "tokens_used": tokens_used,
                 "success": False,
                 "error": str(e)
             }
@@ -240,28 +340,7 @@ class ResponseParser:
         Returns:
             dict or None: Extracted JSON data or None if not found
         """
-        # Look for JSON pattern
-        json_pattern = r'```json\s*([\s\S]*?)\s*```'
-        json_match = re.search(json_pattern, text)
-        
-        if json_match:
-            try:
-                return json.loads(json_match.group(1))
-            except json.JSONDecodeError:
-                pass
-        
-        # Try to find JSON without code blocks
-        try:
-            # Look for text that starts with { and ends with }
-            json_pattern = r'(\{[\s\S]*\})'
-            json_match = re.search(json_pattern, text)
-            
-            if json_match:
-                return json.loads(json_match.group(1))
-        except json.JSONDecodeError:
-            pass
-        
-        return None
+        return _extract_json(text)
     
     def _extract_csv(self, text):
         """
@@ -273,39 +352,8 @@ class ResponseParser:
         Returns:
             list or None: Extracted CSV data as list of lists or None if not found
         """
-        # Look for CSV pattern
-        csv_pattern = r'```csv\s*([\s\S]*?)\s*```'
-        csv_match = re.search(csv_pattern, text)
-        
-        if csv_match:
-            csv_text = csv_match.group(1)
-        else:
-            # Try to find CSV-like content without code blocks
-            lines = text.split('\n')
-            csv_lines = []
-            
-            # Look for lines with consistent delimiter patterns
-            for line in lines:
-                if ',' in line and line.count(',') > 0:
-                    csv_lines.append(line)
-            
-            if len(csv_lines) > 1:
-                csv_text = '\n'.join(csv_lines)
-            else:
-                return None
-        
-        # Parse CSV
-        import csv
-        from io import StringIO
-        
-        csv_data = []
-        csv_file = StringIO(csv_text)
-        csv_reader = csv.reader(csv_file)
-        
-        for row in csv_reader:
-            csv_data.append(row)
-        
-        return csv_data if csv_data else None
+        csv_data = _extract_csv(text)
+        return [list(row) for row in csv_data] if csv_data else None
     
     def _is_action_verb(self, word):
         """
@@ -332,34 +380,37 @@ class ResponseParser:
         """
         Log the response parsing to the audit log.
         
+        The audit details are read straight from the already-built
+        parsed_response rather than copied into an intermediate dict.
+        
         Args:
             original_response (dict): The original response
             parsed_response (dict): The parsed response
         """
         try:
-            details = {
-                "original_format": original_response.get("format", "unknown"),
-                "parsed_format": parsed_response.get("format", "unknown"),
-                "tokens_used": original_response.get("tokens_used", 0),
-                "success": parsed_response.get("success", False),
-                "timestamp": str(now_datetime())
-            }
+            timestamp = now_datetime()
+            success = parsed_response["success"]
             
             audit_log = frappe.get_doc({
                 "doctype": "Gemini Audit Log",
-                "timestamp": now_datetime(),
+                "timestamp": timestamp,
                 "user": frappe.session.user,
                 "action_type": "Function Call",
                 "details": json.dumps({
                     "function": "response_parser",
-                    "details": details
+                    "details": {
+                        "original_format": original_response.get("format", "unknown"),
+                        "parsed_format": parsed_response["format"],
+                        "tokens_used": parsed_response["tokens_used"],
+                        "success": success,
+                        "timestamp": str(timestamp)
+                    }
                 }),
-                "status": "Success" if parsed_response.get("success", False) else "Error",
+                "status": "Success" if success else "Error",
                 "ip_address": frappe.local.request_ip if hasattr(frappe.local, "request_ip") else "127.0.0.1"
             })
             
             audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
             
         except Exception as e:
             frappe.log_error(f"Error logging response parsing: {str(e)}")
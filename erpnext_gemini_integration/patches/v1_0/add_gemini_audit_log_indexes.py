@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Al-Aswany and contributors
+# For license information, please see license.txt
+
+import frappe
+
+def execute():
+    """Add the composite indexes used by audit log reports and filters."""
+    frappe.db.add_index("Gemini Audit Log", ["user", "action_type", "timestamp"])
+    frappe.db.add_index("Gemini Audit Log", ["status", "timestamp"])
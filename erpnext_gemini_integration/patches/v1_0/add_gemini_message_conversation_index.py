@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Al-Aswany and contributors
+# For license information, please see license.txt
+
+import frappe
+
+def execute():
+    """Add the (conversation, timestamp) index used by conversation history queries."""
+    frappe.db.add_index("Gemini Message", ["conversation", "timestamp"])
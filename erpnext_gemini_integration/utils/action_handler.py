@@ -4,8 +4,11 @@
 
 import frappe
 import json
+import sys
+from functools import cached_property
 from frappe import _
 from frappe.utils import now_datetime, cint
+from .audit import SENSITIVE_KEYS
 
 class ActionHandler:
     """
@@ -15,10 +18,17 @@ class ActionHandler:
     custom actions that can be used in workflow automation.
     """
     
+    # Built-in action definitions, shared by all handler instances
+    _builtin_actions = None
+    
     def __init__(self):
         """Initialize the action handler."""
-        self.settings = frappe.get_single("Gemini Assistant Settings")
-        self.registered_actions = self._load_registered_actions()
+        self.registered_actions = dict(self._load_registered_actions())
+    
+    @cached_property
+    def settings(self):
+        """Gemini Assistant Settings, loaded on first access."""
+        return frappe.get_single("Gemini Assistant Settings")
     
     def register_action(self, action_name, description, handler_module, handler_function, allowed_roles=None, parameters=None):
         """
@@ -36,6 +46,10 @@ class ActionHandler:
             dict: Registration result
         """
         try:
+            # Intern the name so later lookups can match on identity
+            if isinstance(action_name, str):
+                action_name = sys.intern(action_name)
+            
             # Check if action already exists
             if action_name in self.registered_actions:
                 return {"success": False, "error": f"Action '{action_name}' already exists"}
@@ -79,12 +93,13 @@ class ActionHandler:
             dict: Result of action execution
         """
         try:
-            # Check if action exists
-            if action_name not in self.registered_actions:
-                return {"success": False, "error": f"Action '{action_name}' not found"}
+            # Get action definition with a single dict probe
+            if isinstance(action_name, str):
+                action_name = sys.intern(action_name)
+            action = self.registered_actions.get(action_name)
             
-            # Get action definition
-            action = self.registered_actions[action_name]
+            if action is None:
+                return {"success": False, "error": f"Action '{action_name}' not found"}
             
             # Check permissions
             if not self._check_action_permissions(action, user or frappe.session.user):
@@ -146,16 +161,23 @@ class ActionHandler:
             frappe.log_error(f"Error getting available actions: {str(e)}")
             return []
     
-    def _load_registered_actions(self):
+    @classmethod
+    def _load_registered_actions(cls):
         """
         Load registered actions from the database.
         
+        The definitions are built once per process and shared between
+        instances; callers must copy the dict before mutating it.
+        
         Returns:
             dict: Dictionary of registered actions
         """
+        if cls._builtin_actions is not None:
+            return cls._builtin_actions
+        
         # In a real implementation, this would load from a custom DocType
         # For now, we'll return a hardcoded example
-        return {
+        cls._builtin_actions = {
             "send_email": {
                 "name": "send_email",
                 "description": "Send an email to specified recipients",
@@ -173,6 +195,8 @@ class ActionHandler:
                 "parameters": ["subject", "description", "assigned_to"]
             }
         }
+        
+        return cls._builtin_actions
     
     def _check_action_permissions(self, action, user):
         """
@@ -244,7 +268,6 @@ class ActionHandler:
             })
             
             audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
             
         except Exception as e:
             frappe.log_error(f"Error logging action registration: {str(e)}")
@@ -260,10 +283,7 @@ class ActionHandler:
         """
         try:
             # Create a safe copy of params without sensitive data
-            safe_params = {}
-            for key, value in (params or {}).items():
-                if key not in ["password", "api_key", "token"]:
-                    safe_params[key] = value
+            safe_params = {k: v for k, v in (params or {}).items() if k not in SENSITIVE_KEYS}
             
             audit_log = frappe.get_doc({
                 "doctype": "Gemini Audit Log",
@@ -281,7 +301,6 @@ class ActionHandler:
             })
             
             audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
             
         except Exception as e:
             frappe.log_error(f"Error logging action execution: {str(e)}")
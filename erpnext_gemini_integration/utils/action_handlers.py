@@ -4,9 +4,74 @@
 
 import frappe
 import json
+import re
+from collections import defaultdict
+from functools import partial
 from frappe import _
 from frappe.utils import now_datetime
 
+try:
+    from erpnext.buying.doctype.purchase_order.purchase_order import make_purchase_invoice, make_purchase_receipt
+    from erpnext.selling.doctype.sales_order.sales_order import make_delivery_note, make_sales_invoice
+except ImportError:
+    # ERPNext is not installed; the order actions report this instead
+    make_purchase_invoice = make_purchase_receipt = make_delivery_note = make_sales_invoice = None
+
+# Validation, permission and missing-document errors are reported back to
+# the caller without writing an Error Log entry
+_EXPECTED_ERRORS = (frappe.ValidationError, frappe.PermissionError, frappe.DoesNotExistError)
+
+# Separator for recipient strings; surrounding whitespace is consumed by the
+# split itself. Whitespace alone is not a separator, so "Name <addr>" survives.
+_RECIPIENT_SPLIT_RE = re.compile(r'\s*[,;]\s*')
+
+# Required parameters per action, with the error returned when missing
+_REQUIRED_PARAMS = {
+    "send_email": (
+        ("recipients", "Recipients are required"),
+        ("subject", "Subject is required"),
+        ("message", "Message is required")
+    ),
+    "create_task": (
+        ("subject", "Subject is required"),
+    ),
+    "update_document": (
+        ("doctype", "DocType is required"),
+        ("docname", "Document name is required"),
+        ("fields", "Fields to update are required")
+    ),
+    "create_document": (
+        ("doctype", "DocType is required"),
+        ("fields", "Fields are required")
+    ),
+    "generate_report": (
+        ("report_name", "Report name is required"),
+    ),
+    "process_purchase_order": (
+        ("purchase_order", "Purchase Order is required"),
+    ),
+    "process_sales_order": (
+        ("sales_order", "Sales Order is required"),
+    )
+}
+
+def _validate_params(action, params):
+    """
+    Check that the required parameters for an action are present.
+    
+    Args:
+        action (str): Action name, a key of _REQUIRED_PARAMS
+        params (dict): Action parameters
+        
+    Returns:
+        dict or None: Error result for the first missing parameter, or None
+    """
+    for key, error in _REQUIRED_PARAMS[action]:
+        if not params.get(key):
+            return {"success": False, "error": error}
+    
+    return None
+
 def handle_send_email(params):
     """
     Handle the send_email action.
@@ -19,36 +84,53 @@ def handle_send_email(params):
     """
     try:
         # Validate required parameters
-        if not params.get("recipients"):
-            return {"success": False, "error": "Recipients are required"}
-        
-        if not params.get("subject"):
-            return {"success": False, "error": "Subject is required"}
-        
-        if not params.get("message"):
-            return {"success": False, "error": "Message is required"}
+        error = _validate_params("send_email", params)
+        if error:
+            return error
         
         # Get recipients
         recipients = params["recipients"]
         if isinstance(recipients, str):
-            recipients = [r.strip() for r in recipients.split(",")]
-        
-        # Send email
-        frappe.sendmail(
-            recipients=recipients,
-            subject=params["subject"],
-            message=params["message"]
-        )
+            recipients = [r for r in _RECIPIENT_SPLIT_RE.split(recipients.strip()) if r]
+        
+        # Queue one email per recipient domain so each Email Queue entry is
+        # a same-domain batch; delivery happens in the queue worker
+        for domain_recipients in _group_by_domain(recipients).values():
+            frappe.sendmail(
+                recipients=domain_recipients,
+                subject=params["subject"],
+                message=params["message"],
+                now=False,
+                delayed=True
+            )
         
         return {
             "success": True,
-            "message": f"Email sent to {len(recipients)} recipients"
+            "message": f"Email queued for {len(recipients)} recipients"
         }
         
+    except _EXPECTED_ERRORS as e:
+        return {"success": False, "error": str(e)}
     except Exception as e:
         frappe.log_error(f"Error handling send_email action: {str(e)}")
         return {"success": False, "error": str(e)}
 
+def _group_by_domain(recipients):
+    """
+    Group email addresses by their (lower-cased) domain.
+    
+    Args:
+        recipients (list): Email addresses
+        
+    Returns:
+        dict: Domain mapped to its recipients, in first-seen order
+    """
+    by_domain = defaultdict(list)
+    for recipient in recipients:
+        by_domain[recipient.rpartition("@")[2].lower()].append(recipient)
+    
+    return by_domain
+
 def handle_create_task(params):
     """
     Handle the create_task action.
@@ -61,8 +143,9 @@ def handle_create_task(params):
     """
     try:
         # Validate required parameters
-        if not params.get("subject"):
-            return {"success": False, "error": "Subject is required"}
+        error = _validate_params("create_task", params)
+        if error:
+            return error
         
         # Create task
         task = frappe.new_doc("Task")
@@ -82,6 +165,8 @@ def handle_create_task(params):
             "message": f"Task '{task.name}' created successfully"
         }
         
+    except _EXPECTED_ERRORS as e:
+        return {"success": False, "error": str(e)}
     except Exception as e:
         frappe.log_error(f"Error handling create_task action: {str(e)}")
         return {"success": False, "error": str(e)}
@@ -98,14 +183,13 @@ def handle_update_document(params):
     """
     try:
         # Validate required parameters
-        if not params.get("doctype"):
-            return {"success": False, "error": "DocType is required"}
-        
-        if not params.get("docname"):
-            return {"success": False, "error": "Document name is required"}
+        error = _validate_params("update_document", params)
+        if error:
+            return error
         
-        if not params.get("fields"):
-            return {"success": False, "error": "Fields to update are required"}
+        # Resolve valid fieldnames once from the cached meta
+        meta = frappe.get_meta(params["doctype"])
+        valid_fields = {df.fieldname for df in meta.fields}
         
         # Get document
         doc = frappe.get_doc(params["doctype"], params["docname"])
@@ -113,7 +197,7 @@ def handle_update_document(params):
         # Update fields
         fields = params["fields"]
         for field, value in fields.items():
-            if hasattr(doc, field):
+            if field in valid_fields:
                 doc.set(field, value)
         
         # Save document
@@ -124,6 +208,8 @@ def handle_update_document(params):
             "message": f"Document {params['doctype']} {params['docname']} updated successfully"
         }
         
+    except _EXPECTED_ERRORS as e:
+        return {"success": False, "error": str(e)}
     except Exception as e:
         frappe.log_error(f"Error handling update_document action: {str(e)}")
         return {"success": False, "error": str(e)}
@@ -140,11 +226,15 @@ def handle_create_document(params):
     """
     try:
         # Validate required parameters
-        if not params.get("doctype"):
-            return {"success": False, "error": "DocType is required"}
+        error = _validate_params("create_document", params)
+        if error:
+            return error
         
-        if not params.get("fields"):
-            return {"success": False, "error": "Fields are required"}
+        # Resolve valid fieldnames once from the cached meta; "name" is
+        # allowed on create for Prompt and By fieldname naming rules
+        meta = frappe.get_meta(params["doctype"])
+        valid_fields = {df.fieldname for df in meta.fields}
+        valid_fields.add("name")
         
         # Create document
         doc = frappe.new_doc(params["doctype"])
@@ -152,7 +242,7 @@ def handle_create_document(params):
         # Set fields
         fields = params["fields"]
         for field, value in fields.items():
-            if hasattr(doc, field):
+            if field in valid_fields:
                 doc.set(field, value)
         
         # Insert document
@@ -164,6 +254,8 @@ def handle_create_document(params):
             "message": f"Document {params['doctype']} {doc.name} created successfully"
         }
         
+    except _EXPECTED_ERRORS as e:
+        return {"success": False, "error": str(e)}
     except Exception as e:
         frappe.log_error(f"Error handling create_document action: {str(e)}")
         return {"success": False, "error": str(e)}
@@ -180,8 +272,9 @@ def handle_generate_report(params):
     """
     try:
         # Validate required parameters
-        if not params.get("report_name"):
-            return {"success": False, "error": "Report name is required"}
+        error = _validate_params("generate_report", params)
+        if error:
+            return error
         
         # Get report
         report_name = params["report_name"]
@@ -207,6 +300,8 @@ def handle_generate_report(params):
             "data": result
         }
         
+    except _EXPECTED_ERRORS as e:
+        return {"success": False, "error": str(e)}
     except Exception as e:
         frappe.log_error(f"Error handling generate_report action: {str(e)}")
         return {"success": False, "error": str(e)}
@@ -225,74 +320,31 @@ def handle_process_purchase_order(params):
     """
     try:
         # Validate required parameters
-        if not params.get("purchase_order"):
-            return {"success": False, "error": "Purchase Order is required"}
-        
-        # Get Purchase Order
-        po_name = params["purchase_order"]
-        po = frappe.get_doc("Purchase Order", po_name)
+        error = _validate_params("process_purchase_order", params)
+        if error:
+            return error
         
-        # Check action to perform
+        # Resolve the action before loading the document
         action = params.get("action", "submit")
+        handler = _PURCHASE_ORDER_ACTIONS.get(action)
         
-        if action == "submit":
-            # Submit Purchase Order
-            if po.docstatus == 0:
-                po.submit()
-                return {
-                    "success": True,
-                    "message": f"Purchase Order {po_name} submitted successfully"
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"Purchase Order {po_name} is already submitted or cancelled"
-                }
-                
-        elif action == "create_receipt":
-            # Create Purchase Receipt
-            from erpnext.stock.doctype.purchase_receipt.purchase_receipt import make_purchase_receipt
-            
-            if po.docstatus == 1:
-                pr = make_purchase_receipt(po_name)
-                pr.insert()
-                
-                return {
-                    "success": True,
-                    "purchase_receipt": pr.name,
-                    "message": f"Purchase Receipt {pr.name} created successfully"
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"Purchase Order {po_name} must be submitted to create receipt"
-                }
-                
-        elif action == "create_invoice":
-            # Create Purchase Invoice
-            from erpnext.accounts.doctype.purchase_invoice.purchase_invoice import make_purchase_invoice
-            
-            if po.docstatus == 1:
-                pi = make_purchase_invoice(po_name)
-                pi.insert()
-                
-                return {
-                    "success": True,
-                    "purchase_invoice": pi.name,
-                    "message": f"Purchase Invoice {pi.name} created successfully"
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"Purchase Order {po_name} must be submitted to create invoice"
-                }
-        
-        else:
+        if not handler:
             return {
                 "success": False,
                 "error": f"Unknown action: {action}"
             }
         
+        # Read only the docstatus; handlers load the full order when needed
+        po_name = params["purchase_order"]
+        docstatus = frappe.db.get_value("Purchase Order", po_name, "docstatus")
+        
+        if docstatus is None:
+            return {"success": False, "error": f"Purchase Order {po_name} not found"}
+        
+        return handler("Purchase Order", po_name, docstatus)
+        
+    except _EXPECTED_ERRORS as e:
+        return {"success": False, "error": str(e)}
     except Exception as e:
         frappe.log_error(f"Error handling process_purchase_order action: {str(e)}")
         return {"success": False, "error": str(e)}
@@ -311,74 +363,132 @@ def handle_process_sales_order(params):
     """
     try:
         # Validate required parameters
-        if not params.get("sales_order"):
-            return {"success": False, "error": "Sales Order is required"}
-        
-        # Get Sales Order
-        so_name = params["sales_order"]
-        so = frappe.get_doc("Sales Order", so_name)
+        error = _validate_params("process_sales_order", params)
+        if error:
+            return error
         
-        # Check action to perform
+        # Resolve the action before loading the document
         action = params.get("action", "submit")
+        handler = _SALES_ORDER_ACTIONS.get(action)
         
-        if action == "submit":
-            # Submit Sales Order
-            if so.docstatus == 0:
-                so.submit()
-                return {
-                    "success": True,
-                    "message": f"Sales Order {so_name} submitted successfully"
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"Sales Order {so_name} is already submitted or cancelled"
-                }
-                
-        elif action == "create_delivery":
-            # Create Delivery Note
-            from erpnext.selling.doctype.sales_order.sales_order import make_delivery_note
-            
-            if so.docstatus == 1:
-                dn = make_delivery_note(so_name)
-                dn.insert()
-                
-                return {
-                    "success": True,
-                    "delivery_note": dn.name,
-                    "message": f"Delivery Note {dn.name} created successfully"
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"Sales Order {so_name} must be submitted to create delivery note"
-                }
-                
-        elif action == "create_invoice":
-            # Create Sales Invoice
-            from erpnext.selling.doctype.sales_order.sales_order import make_sales_invoice
-            
-            if so.docstatus == 1:
-                si = make_sales_invoice(so_name)
-                si.insert()
-                
-                return {
-                    "success": True,
-                    "sales_invoice": si.name,
-                    "message": f"Sales Invoice {si.name} created successfully"
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"Sales Order {so_name} must be submitted to create invoice"
-                }
-        
-        else:
+        if not handler:
             return {
                 "success": False,
                 "error": f"Unknown action: {action}"
             }
         
+        # Read only the docstatus; handlers load the full order when needed
+        so_name = params["sales_order"]
+        docstatus = frappe.db.get_value("Sales Order", so_name, "docstatus")
+        
+        if docstatus is None:
+            return {"success": False, "error": f"Sales Order {so_name} not found"}
+        
+        return handler("Sales Order", so_name, docstatus)
+        
+    except _EXPECTED_ERRORS as e:
+        return {"success": False, "error": str(e)}
     except Exception as e:
         frappe.log_error(f"Error handling process_sales_order action: {str(e)}")
         return {"success": False, "error": str(e)}
+
+def _submit_document(doctype, name, docstatus):
+    """
+    Submit a draft document.
+    
+    The document is only loaded once its docstatus shows it can be submitted.
+    
+    Args:
+        doctype (str): DocType of the document
+        name (str): Name of the document
+        docstatus (int): Current docstatus of the document
+        
+    Returns:
+        dict: Result of action execution
+    """
+    if docstatus != 0:
+        return {
+            "success": False,
+            "error": f"{doctype} {name} is already submitted or cancelled"
+        }
+    
+    frappe.get_doc(doctype, name).submit()
+    
+    return {
+        "success": True,
+        "message": f"{doctype} {name} submitted successfully"
+    }
+
+def _create_from_submitted(doctype, name, docstatus, make_document, result_key, target_label, purpose):
+    """
+    Create and insert a follow-up document from a submitted document.
+    
+    The ERPNext mappers take the source name and load it themselves, so the
+    source document is never loaded here.
+    
+    Args:
+        doctype (str): DocType of the source document
+        name (str): Name of the source document
+        docstatus (int): Current docstatus of the source document
+        make_document (callable): ERPNext mapper taking the source name
+        result_key (str): Key for the new document name in the result
+        target_label (str): Label of the created DocType for messages
+        purpose (str): What the source must be submitted for, for errors
+        
+    Returns:
+        dict: Result of action execution
+    """
+    if make_document is None:
+        return {"success": False, "error": "ERPNext is required for this action"}
+    
+    if docstatus != 1:
+        return {
+            "success": False,
+            "error": f"{doctype} {name} must be submitted to {purpose}"
+        }
+    
+    target = make_document(name)
+    target.insert()
+    
+    return {
+        "success": True,
+        result_key: target.name,
+        "message": f"{target_label} {target.name} created successfully"
+    }
+
+# Action dispatch tables for the order handlers
+_PURCHASE_ORDER_ACTIONS = {
+    "submit": _submit_document,
+    "create_receipt": partial(
+        _create_from_submitted,
+        make_document=make_purchase_receipt,
+        result_key="purchase_receipt",
+        target_label="Purchase Receipt",
+        purpose="create receipt"
+    ),
+    "create_invoice": partial(
+        _create_from_submitted,
+        make_document=make_purchase_invoice,
+        result_key="purchase_invoice",
+        target_label="Purchase Invoice",
+        purpose="create invoice"
+    )
+}
+
+_SALES_ORDER_ACTIONS = {
+    "submit": _submit_document,
+    "create_delivery": partial(
+        _create_from_submitted,
+        make_document=make_delivery_note,
+        result_key="delivery_note",
+        target_label="Delivery Note",
+        purpose="create delivery note"
+    ),
+    "create_invoice": partial(
+        _create_from_submitted,
+        make_document=make_sales_invoice,
+        result_key="sales_invoice",
+        target_label="Sales Invoice",
+        purpose="create invoice"
+    )
+}
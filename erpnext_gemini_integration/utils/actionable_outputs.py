@@ -11,10 +11,63 @@ from ..gemini.prompt_builder import PromptBuilder
 from ..gemini.response_parser import ResponseParser
 from ..gemini.exceptions import GeminiOutputError
 from weasyprint import HTML, CSS
-from io import BytesIO
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.ticker import MaxNLocator
 import pandas as pd
 import base64
+import threading
+
+_CHART_TYPES = frozenset(("bar", "line", "pie", "scatter"))
+
+# A 10x6 figure cannot show more points than this on a line chart
+_MAX_LINE_POINTS = 5000
+
+# Charts with fewer rows than this are written as SVG; past it the vector
+# output grows larger than the equivalent PNG
+_MAX_SVG_POINTS = 2000
+
+# Category labels are rotated past this many bars and thinned out past the
+# second limit, since laying out one label per bar dominates render time
+_ROTATE_LABELS_OVER = 8
+_MAX_CATEGORY_LABELS = 30
+
+# Fixed subplot margins; cheaper than running a layout solver per chart.
+# The bottom margin leaves room for rotated category labels
+_CHART_MARGINS = {"left": 0.1, "right": 0.98, "top": 0.9, "bottom": 0.25}
+_PIE_MARGINS = {"left": 0.05, "right": 0.95, "top": 0.9, "bottom": 0.05}
+
+# Rows beyond this are not rendered into a data table; a chat reply cannot
+# usefully show more and to_html cost grows with every cell
+_MAX_TABLE_ROWS = 500
+
+# One reusable Figure per worker thread
+_local = threading.local()
+
+def _get_chart_figure(margins):
+    """
+    Return this thread's chart figure, cleared and ready for a new chart.
+    
+    The Figure and its Agg canvas are created once per thread and reused,
+    which saves rebuilding them for every chart. The figure is built outside
+    pyplot, so it is never registered in the global figure list.
+    
+    Args:
+        margins (dict): Subplot margins passed to subplots_adjust
+        
+    Returns:
+        tuple: (figure, canvas, axes)
+    """
+    fig = getattr(_local, "chart_figure", None)
+    if fig is None:
+        fig = Figure(figsize=(10, 6))
+        FigureCanvasAgg(fig)
+        _local.chart_figure = fig
+    
+    fig.clear()
+    fig.subplots_adjust(**margins)
+    
+    return fig, fig.canvas, fig.subplots()
 
 class ActionableOutputs:
     """
@@ -163,7 +216,7 @@ class ActionableOutputs:
                 "error": str(e)
             }
     
-    def generate_chart(self, data, chart_type="bar", title=None, x_label=None, y_label=None, as_image=True):
+    def generate_chart(self, data, chart_type="bar", title=None, x_label=None, y_label=None, as_image=True, prefer_svg=False):
         """
         Generate a chart from data.
         
@@ -174,11 +227,16 @@ class ActionableOutputs:
             x_label (str, optional): X-axis label
             y_label (str, optional): Y-axis label
             as_image (bool): Whether to return as image or JSON
+            prefer_svg (bool): Save small charts as SVG rather than PNG (default False)
             
         Returns:
             dict: Result with chart data or image
         """
         try:
+            # Reject unsupported requests before paying for the DataFrame
+            if chart_type not in _CHART_TYPES:
+                raise ValueError(f"Unsupported chart type: {chart_type}")
+            
             # Convert data to pandas DataFrame if needed
             if isinstance(data, list) and all(isinstance(item, dict) for item in data):
                 df = pd.DataFrame(data)
@@ -192,111 +250,123 @@ class ActionableOutputs:
             else:
                 df = pd.DataFrame(data)
             
-            # Create figure and axis
-            plt.figure(figsize=(10, 6))
+            if chart_type == "scatter" and len(df.columns) < 2:
+                raise ValueError("Scatter plot requires at least two columns of data")
+            
+            if chart_type == "line" and df.select_dtypes('number').empty:
+                raise ValueError("Line chart requires at least one numeric column")
+            
+            if not as_image:
+                # Return chart as JSON for frontend rendering; the frontend
+                # draws it, so no figure is built here
+                chart_data = {
+                    "type": chart_type,
+                    "title": title,
+                    "x_label": x_label,
+                    "y_label": y_label,
+                    "data": df.to_dict(orient='records')
+                }
+                
+                # Log the chart generation
+                self._log_output_generation("Chart JSON", None)
+                
+                return {
+                    "success": True,
+                    "chart_data": chart_data,
+                    "message": "Chart data generated successfully"
+                }
+            
+            fig, canvas, ax = _get_chart_figure(_PIE_MARGINS if chart_type == "pie" else _CHART_MARGINS)
             
             # Generate chart based on type
             if chart_type == "bar":
                 if 'Category' in df.columns and 'Value' in df.columns:
-                    ax = df.plot(kind='bar', x='Category', y='Value')
+                    # Draw the two-column case directly; the pandas plotting
+                    # accessor only adds another round of dtype inference
+                    ax.bar(df['Category'].astype(str).to_numpy(), df['Value'].to_numpy())
+                    
+                    if len(df) > _ROTATE_LABELS_OVER:
+                        ax.tick_params(axis='x', labelrotation=90)
+                    
+                    if len(df) > _MAX_CATEGORY_LABELS:
+                        ax.xaxis.set_major_locator(MaxNLocator(nbins=_MAX_CATEGORY_LABELS, integer=True))
                 else:
-                    ax = df.plot(kind='bar')
+                    df.plot(kind='bar', ax=ax)
             
             elif chart_type == "line":
-                ax = df.plot(kind='line')
+                # Stride-sample long series so plotting cost stays bounded
+                if len(df) > _MAX_LINE_POINTS:
+                    df = df.iloc[::-(-len(df) // _MAX_LINE_POINTS)]
+                
+                numeric = df.select_dtypes('number')
+                ax.plot(numeric.index.to_numpy(), numeric.to_numpy())
+                ax.legend([str(col) for col in numeric.columns])
             
             elif chart_type == "pie":
                 if 'Category' in df.columns and 'Value' in df.columns:
-                    ax = df.plot(kind='pie', y='Value', labels=df['Category'])
+                    ax.pie(df['Value'].to_numpy(), labels=df['Category'].astype(str).to_numpy())
                 else:
-                    ax = df.plot(kind='pie', subplots=True)
+                    df.plot(kind='pie', y=df.columns[0], ax=ax)
             
-            elif chart_type == "scatter":
-                if len(df.columns) >= 2:
-                    ax = df.plot(kind='scatter', x=df.columns[0], y=df.columns[1])
-                else:
-                    raise ValueError("Scatter plot requires at least two columns of data")
-            
-            else:
-                raise ValueError(f"Unsupported chart type: {chart_type}")
+            else:  # scatter
+                ax.scatter(df.iloc[:, 0].to_numpy(), df.iloc[:, 1].to_numpy())
+                ax.set_xlabel(str(df.columns[0]))
+                ax.set_ylabel(str(df.columns[1]))
             
             # Add title and labels
             if title:
-                plt.title(title)
+                ax.set_title(title)
             
             if x_label:
-                plt.xlabel(x_label)
+                ax.set_xlabel(x_label)
             
             if y_label:
-                plt.ylabel(y_label)
+                ax.set_ylabel(y_label)
             
-            plt.tight_layout()
+            # Small charts skip rasterization entirely and stay crisp at any size
+            use_svg = prefer_svg and len(df) < _MAX_SVG_POINTS
             
-            if as_image:
-                # Save chart to BytesIO
-                img_buffer = BytesIO()
-                plt.savefig(img_buffer, format='png')
-                img_buffer.seek(0)
-                
-                # Create temporary file
-                file_name = f"gemini_chart_{frappe.utils.now().strftime('%Y%m%d%H%M%S')}.png"
-                file_path = frappe.get_site_path('private', 'files', file_name)
-                
-                # Save to file
-                with open(file_path, 'wb') as f:
-                    f.write(img_buffer.getvalue())
-                
-                # Create File document
-                file_doc = frappe.get_doc({
-                    "doctype": "File",
-                    "file_name": file_name,
-                    "file_url": f"/private/files/{file_name}",
-                    "is_private": 1,
-                    "attached_to_doctype": "Gemini Conversation",
-                    "attached_to_name": frappe.form_dict.get("conversation") or "General"
-                })
-                file_doc.insert(ignore_permissions=True)
-                
-                # Log the chart generation
-                self._log_output_generation("Chart Image", file_doc.file_url)
-                
-                # Close the plot to free memory
-                plt.close()
-                
-                return {
-                    "success": True,
-                    "file_url": file_doc.file_url,
-                    "file_name": file_name,
-                    "message": "Chart generated successfully"
-                }
+            # Create temporary file
+            file_name = f"gemini_chart_{frappe.utils.now().strftime('%Y%m%d%H%M%S')}.{'svg' if use_svg else 'png'}"
+            file_path = frappe.get_site_path('private', 'files', file_name)
             
-            else:
-                # Return chart as JSON for frontend rendering
-                # Convert DataFrame to dict for JSON serialization
-                chart_data = {
-                    "type": chart_type,
-                    "title": title,
-                    "x_label": x_label,
-                    "y_label": y_label,
-                    "data": df.to_dict(orient='records')
-                }
-                
-                # Log the chart generation
-                self._log_output_generation("Chart JSON", None)
-                
-                # Close the plot to free memory
-                plt.close()
-                
-                return {
-                    "success": True,
-                    "chart_data": chart_data,
-                    "message": "Chart data generated successfully"
-                }
+            # Render straight into the file; there is no need to stage the
+            # image in an in-memory buffer first. Charts are mostly flat
+            # colour, so a lighter deflate level encodes PNGs much faster for
+            # a near-identical file size
+            with open(file_path, 'wb') as f:
+                if use_svg:
+                    # print_figure swaps in the SVG backend only for this call,
+                    # leaving the reusable figure on its Agg canvas
+                    canvas.print_figure(f, format="svg")
+                else:
+                    canvas.print_png(f, pil_kwargs={"compress_level": 3})
             
-        except Exception as e:
-            # Close any open plots to free memory
-            plt.close('all')
+            # Drop the plotted artists but keep the figure for the next chart
+            fig.clear()
+            
+            # Create File document
+            file_doc = frappe.get_doc({
+                "doctype": "File",
+                "file_name": file_name,
+                "file_url": f"/private/files/{file_name}",
+                "is_private": 1,
+                "attached_to_doctype": "Gemini Conversation",
+                "attached_to_name": frappe.form_dict.get("conversation") or "General"
+            })
+            file_doc.insert(ignore_permissions=True)
+            
+            # Log the chart generation
+            self._log_output_generation("Chart Image", file_doc.file_url)
+            
+            return {
+                "success": True,
+                "file_url": file_doc.file_url,
+                "file_name": file_name,
+                "message": "Chart generated successfully"
+            }
             
+        except Exception as e:
             frappe.log_error(f"Error generating chart: {str(e)}")
             return {
                 "success": False,
@@ -401,18 +471,29 @@ class ActionableOutputs:
             dict: Result with HTML table
         """
         try:
+            # Truncate before building the DataFrame so the dropped rows are
+            # never materialized
+            total_rows = len(data)
+            if total_rows > _MAX_TABLE_ROWS:
+                data = data[:_MAX_TABLE_ROWS]
+            
             # Convert data to pandas DataFrame
             df = pd.DataFrame(data)
             
             # Generate HTML table
             html_table = df.to_html(classes='table table-striped table-bordered', index=False)
             
+            truncation_note = ""
+            if total_rows > _MAX_TABLE_ROWS:
+                truncation_note = f"<p>Showing the first {_MAX_TABLE_ROWS} of {total_rows} rows.</p>"
+            
             # Add title and description
             html_content = f"""
             <div class="gemini-data-table">
                 <h2>{title or "Data Table"}</h2>
                 {f"<p>{description}</p>" if description else ""}
                 {html_table}
+                {truncation_note}
             </div>
             """
             
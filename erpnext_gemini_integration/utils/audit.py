@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Al-Aswany and contributors
+# For license information, please see license.txt
+
+import frappe
+import json
+from frappe.utils import now_datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Parameter names that are never written to the audit log
+SENSITIVE_KEYS = frozenset({"password", "api_key", "token", "secret", "authorization"})
+
+def enqueue_audit_log(action_type, details, status="Success"):
+    """
+    Queue a Gemini Audit Log entry to be written in the background.
+    
+    The job is only enqueued once the current transaction commits, so the
+    request path no longer pays for the insert and its commit.
+    
+    Args:
+        action_type (str): Audit log action type
+        details (dict): Details to store as JSON
+        status (str, optional): Log status. Defaults to "Success".
+    """
+    frappe.enqueue(
+        "erpnext_gemini_integration.utils.audit.write_audit_log",
+        queue="short",
+        enqueue_after_commit=True,
+        action_type=action_type,
+        details=details,
+        status=status,
+        user=frappe.session.user,
+        ip_address=frappe.local.request_ip if hasattr(frappe.local, "request_ip") else "127.0.0.1",
+        timestamp=now_datetime()
+    )
+
+def dumps_details(details, pretty=False):
+    """
+    Serialize audit log details to a JSON string.
+    
+    Uses orjson when it is installed (it ships with recent Frappe
+    versions) and falls back to the standard library otherwise, or when
+    orjson cannot encode a value (e.g. integers outside the 64-bit range).
+    
+    Args:
+        details (dict): Details to serialize
+        pretty (bool, optional): Indent the output by two spaces
+        
+    Returns:
+        str: JSON string
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(details, option=orjson.OPT_INDENT_2 if pretty else None).decode()
+        except orjson.JSONEncodeError:
+            pass
+    
+    return json.dumps(details, indent=2 if pretty else None)
+
+def write_audit_log(action_type, details, status, user, ip_address, timestamp):
+    """
+    Insert a Gemini Audit Log entry. Runs as a background job.
+    
+    Args:
+        action_type (str): Audit log action type
+        details (dict): Details to store as JSON
+        status (str): Log status
+        user (str): User who triggered the logged action
+        ip_address (str): Request IP address
+        timestamp (datetime): Time the action was logged
+    """
+    try:
+        audit_log = frappe.get_doc({
+            "doctype": "Gemini Audit Log",
+            "timestamp": timestamp,
+            "user": user,
+            "action_type": action_type,
+            "details": dumps_details(details),
+            "status": status,
+            "ip_address": ip_address
+        })
+        
+        audit_log.insert(ignore_permissions=True)
+        
+    except Exception as e:
+        frappe.log_error(f"Error writing audit log: {str(e)}")
@@ -3,10 +3,26 @@
 # For license information, please see license.txt
 
 import frappe
-import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from frappe import _
 from frappe.utils import now_datetime, cint
 from ..gemini.exceptions import GeminiContextError
+from .audit import enqueue_audit_log
+
+# Process-wide cache of the last seen context per conversation, keyed by
+# (site, conversation_id) and capped to the most recently used entries
+_CONTEXT_CACHE_SIZE = 512
+_context_cache = OrderedDict()
+_context_cache_lock = threading.Lock()
+
+# A DocType's module is treated as static: moving a DocType to another
+# module is only picked up once the worker process restarts
+@lru_cache(maxsize=1024)
+def _get_doctype_module(site, doctype):
+    """Return the module of a DocType; memoized per site."""
+    return frappe.get_meta(doctype).module
 
 class ContextManager:
     """
@@ -18,9 +34,8 @@ class ContextManager:
     
     def __init__(self):
         """Initialize the context manager."""
-        self.settings = frappe.get_single("Gemini Assistant Settings")
+        self.settings = frappe.get_cached_doc("Gemini Assistant Settings")
         self.max_history_messages = 10  # Default value
-        self.context_cache = {}
     
     def get_conversation_context(self, conversation_id, include_history=True):
         """
@@ -38,8 +53,16 @@ class ContextManager:
             if not self.settings.enable_context_awareness:
                 return {"context_enabled": False}
             
-            # Get conversation details
-            conversation = frappe.get_doc("Gemini Conversation", conversation_id)
+            # Get conversation details as a single row; the full document is not needed
+            conversation = frappe.db.get_value(
+                "Gemini Conversation",
+                conversation_id,
+                ["user", "start_time", "context_doctype", "context_docname"],
+                as_dict=True
+            )
+            
+            if not conversation:
+                frappe.throw(_("Gemini Conversation {0} not found").format(conversation_id), frappe.DoesNotExistError)
             
             # Build context dictionary
             context = {
@@ -79,6 +102,9 @@ class ContextManager:
             
             return context
             
+        except frappe.DoesNotExistError as e:
+            # A missing conversation is a caller error, not worth an Error Log
+            raise GeminiContextError(f"Error getting conversation context: {str(e)}")
         except Exception as e:
             frappe.log_error(f"Error getting conversation context: {str(e)}")
             raise GeminiContextError(f"Error getting conversation context: {str(e)}")
@@ -95,32 +121,41 @@ class ContextManager:
             str: Formatted conversation history
         """
         try:
-            # Use provided max_messages or default
-            limit = max_messages or self.max_history_messages
-            
-            # Get messages
-            messages = frappe.get_all(
-                "Gemini Message",
-                filters={"conversation": conversation_id},
-                fields=["role", "content"],
-                order_by="timestamp asc",
-                limit=limit
-            )
-            
-            if not messages:
-                return ""
-            
-            # Format history
-            history = ""
-            for msg in messages:
-                history += f"{msg.role}: {msg.content}\n\n"
-            
-            return history
+            return "".join(self.iter_conversation_history(conversation_id, max_messages))
             
         except Exception as e:
             frappe.log_error(f"Error getting conversation history: {str(e)}")
             return ""
     
+    def iter_conversation_history(self, conversation_id, max_messages=None):
+        """
+        Yield the conversation history one formatted message at a time.
+        
+        Lets callers that write the history out incrementally avoid building
+        the full history string in memory.
+        
+        Args:
+            conversation_id (str): Conversation ID
+            max_messages (int, optional): Maximum number of messages to include
+            
+        Yields:
+            str: A formatted "role: content" block per message
+        """
+        # Use provided max_messages or default
+        limit = max_messages or self.max_history_messages
+        
+        # Get messages
+        messages = frappe.get_all(
+            "Gemini Message",
+            filters={"conversation": conversation_id},
+            fields=["role", "content"],
+            order_by="timestamp asc",
+            limit=limit
+        )
+        
+        for msg in messages:
+            yield f"{msg.role}: {msg.content}\n\n"
+    
     def get_active_doctype_context(self):
         """
         Get context information for the active doctype.
@@ -141,14 +176,11 @@ class ContextManager:
                 doctype = route[1]
                 docname = route[2]
                 
-                # Get document metadata
-                meta = frappe.get_meta(doctype)
-                
                 # Build context
                 context = {
                     "doctype": doctype,
                     "docname": docname,
-                    "module": meta.module,
+                    "module": _get_doctype_module(frappe.local.site, doctype),
                     "context_enabled": True
                 }
                 
@@ -169,13 +201,10 @@ class ContextManager:
             elif len(route) >= 2 and route[0] == "List":
                 doctype = route[1]
                 
-                # Get doctype metadata
-                meta = frappe.get_meta(doctype)
-                
                 # Build context
                 context = {
                     "doctype": doctype,
-                    "module": meta.module,
+                    "module": _get_doctype_module(frappe.local.site, doctype),
                     "view": "List",
                     "context_enabled": True
                 }
@@ -204,19 +233,19 @@ class ContextManager:
             bool: Success status
         """
         try:
-            # Get conversation
-            conversation = frappe.get_doc("Gemini Conversation", conversation_id)
-            
             # Update doctype and docname if provided
+            values = {}
+            
             if "doctype" in context_data:
-                conversation.context_doctype = context_data["doctype"]
+                values["context_doctype"] = context_data["doctype"]
                 
             if "docname" in context_data:
-                conversation.context_docname = context_data["docname"]
+                values["context_docname"] = context_data["docname"]
             
-            # Save changes
-            conversation.save(ignore_permissions=True)
-            frappe.db.commit()
+            # Write the columns directly; the conversation has no controller
+            # logic that needs to run for a context change
+            if values:
+                frappe.db.set_value("Gemini Conversation", conversation_id, values)
             
             # Update cache
             self._update_context_cache(conversation_id, context_data)
@@ -281,7 +310,14 @@ class ContextManager:
         Returns:
             dict: Cached context or None
         """
-        return self.context_cache.get(conversation_id)
+        key = (frappe.local.site, conversation_id)
+        
+        with _context_cache_lock:
+            context = _context_cache.get(key)
+            if context is not None:
+                _context_cache.move_to_end(key)
+            
+            return context
     
     def _update_context_cache(self, conversation_id, context_data):
         """
@@ -291,7 +327,15 @@ class ContextManager:
             conversation_id (str): Conversation ID
             context_data (dict): Context data to cache
         """
-        self.context_cache[conversation_id] = context_data
+        key = (frappe.local.site, conversation_id)
+        
+        with _context_cache_lock:
+            _context_cache[key] = context_data
+            _context_cache.move_to_end(key)
+            
+            # Evict the least recently used entries
+            while len(_context_cache) > _CONTEXT_CACHE_SIZE:
+                _context_cache.popitem(last=False)
     
     def _log_context_retrieval(self, conversation_id, context):
         """
@@ -312,23 +356,12 @@ class ContextManager:
                 "timestamp": str(now_datetime())
             }
             
-            audit_log = frappe.get_doc({
-                "doctype": "Gemini Audit Log",
-                "timestamp": now_datetime(),
-                "user": frappe.session.user,
-                "action_type": "Function Call",
-                "details": json.dumps({
-                    "function": "context_manager",
-                    "action": "context_retrieval",
-                    "details": safe_context
-                }),
-                "status": "Success",
-                "ip_address": frappe.local.request_ip if hasattr(frappe.local, "request_ip") else "127.0.0.1"
+            enqueue_audit_log("Function Call", {
+                "function": "context_manager",
+                "action": "context_retrieval",
+                "details": safe_context
             })
             
-            audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
-            
         except Exception as e:
             frappe.log_error(f"Error logging context retrieval: {str(e)}")
     
@@ -348,22 +381,11 @@ class ContextManager:
                 "timestamp": str(now_datetime())
             }
             
-            audit_log = frappe.get_doc({
-                "doctype": "Gemini Audit Log",
-                "timestamp": now_datetime(),
-                "user": frappe.session.user,
-                "action_type": "Function Call",
-                "details": json.dumps({
-                    "function": "context_manager",
-                    "action": "context_update",
-                    "details": safe_context
-                }),
-                "status": "Success",
-                "ip_address": frappe.local.request_ip if hasattr(frappe.local, "request_ip") else "127.0.0.1"
+            enqueue_audit_log("Function Call", {
+                "function": "context_manager",
+                "action": "context_update",
+                "details": safe_context
             })
             
-            audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
-            
         except Exception as e:
             frappe.log_error(f"Error logging context update: {str(e)}")
@@ -6,11 +6,179 @@ import frappe
 import os
 import json
 import base64
+import struct
 import tempfile
+import threading
 import mimetypes
+from collections import OrderedDict
 from frappe import _
 from frappe.utils import now_datetime, cint
 from ..gemini.exceptions import GeminiFileProcessingError
+from .audit import enqueue_audit_log, dumps_details
+
+# Remote downloads are streamed in chunks and capped in size
+_REMOTE_TIMEOUT = (5, 30)
+_REMOTE_CHUNK_SIZE = 64 * 1024
+_DEFAULT_MAX_REMOTE_FILE_SIZE = 50  # MB
+
+# Rows of a CSV rendered as text; the rest is dropped
+_MAX_CSV_ROWS = 50000
+
+# Largest JSON file that is parsed and pretty-printed
+_MAX_JSON_SIZE = 10 * 1024 * 1024
+
+# MIME types of the supported document and code formats
+_EXT_TO_MIME = {
+    "pdf": "application/pdf",
+    "txt": "text/plain",
+    "csv": "text/csv",
+    "json": "application/json",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "py": "text/x-python",
+    "js": "text/javascript",
+    "html": "text/html",
+    "css": "text/css",
+    "xml": "application/xml",
+}
+
+_http_session = None
+_mime_detector = None
+
+# Concurrent downloads in process_many
+_MAX_DOWNLOAD_WORKERS = 8
+
+# Reused processors, one per thread and site
+_local = threading.local()
+
+# Documents whose extracted text is kept per processor
+_TEXT_CACHE_SIZE = 8
+
+# Leading bytes of the supported formats that are cheap to recognise.
+# Zip-based Office files share a signature, so those go to libmagic.
+_FILE_SIGNATURES = (
+    (b"%PDF", "pdf"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG", "png"),
+    (b"GIF8", "gif"),
+)
+
+def _get_http_session():
+    """Return a process-wide requests session so connections are reused."""
+    global _http_session
+    
+    if _http_session is None:
+        import requests
+        _http_session = requests.Session()
+    
+    return _http_session
+
+def _sniff_file_type(content):
+    """
+    Detect a file type from its leading bytes.
+    
+    Args:
+        content (bytes): File content
+        
+    Returns:
+        str: File extension, or None if it could not be detected
+    """
+    header = content[:16]
+    
+    for signature, file_type in _FILE_SIGNATURES:
+        if header.startswith(signature):
+            return file_type
+    
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    
+    if header.lstrip()[:1] == b"{":
+        return "json"
+    
+    # Fall back to libmagic, loading its database only once per process
+    global _mime_detector
+    if _mime_detector is None:
+        import magic
+        _mime_detector = magic.Magic(mime=True)
+    
+    # Convert MIME type to extension
+    extension = mimetypes.guess_extension(_mime_detector.from_buffer(content))
+    return extension.lstrip('.').lower() if extension else None
+
+# JPEG start-of-frame markers, which carry the image dimensions
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def _image_dimensions(content):
+    """
+    Read the width and height of a PNG, GIF, JPEG or WebP image from its headers.
+    
+    Args:
+        content (bytes): Image file content
+        
+    Returns:
+        tuple: (width, height), or None if the headers could not be parsed
+    """
+    try:
+        if content[:8] == b"\x89PNG\r\n\x1a\n" and content[12:16] == b"IHDR":
+            return struct.unpack(">II", content[16:24])
+        
+        if content[:4] == b"GIF8":
+            return struct.unpack("<HH", content[6:10])
+        
+        if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+            chunk = content[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", content[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                bits = struct.unpack("<I", content[21:25])[0]
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                return (int.from_bytes(content[24:27], "little") + 1,
+                        int.from_bytes(content[27:30], "little") + 1)
+            return None
+        
+        if content[:2] == b"\xff\xd8":
+            # Walk the marker segments until a start-of-frame segment
+            i = 2
+            while i + 9 <= len(content):
+                if content[i] != 0xFF:
+                    return None
+                
+                marker = content[i + 1]
+                if marker == 0xFF:
+                    # Fill byte
+                    i += 1
+                elif marker in _JPEG_SOF_MARKERS:
+                    height, width = struct.unpack(">HH", content[i + 5:i + 9])
+                    return width, height
+                elif marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                    # Standalone markers have no length field
+                    i += 2
+                else:
+                    i += 2 + struct.unpack(">H", content[i + 2:i + 4])[0]
+    
+    except struct.error:
+        pass
+    
+    return None
+
+def get_file_processor():
+    """
+    Return a FileProcessor reused across calls on the current thread and site.
+    
+    Returns:
+        FileProcessor: File processor instance
+    """
+    processors = getattr(_local, "processors", None)
+    if processors is None:
+        processors = _local.processors = {}
+    
+    site = frappe.local.site
+    if site not in processors:
+        processors[site] = FileProcessor()
+    
+    return processors[site]
 
 class FileProcessor:
     """
@@ -22,15 +190,32 @@ class FileProcessor:
     
     def __init__(self):
         """Initialize the file processor."""
-        self.settings = frappe.get_single("Gemini Assistant Settings")
         self.supported_file_types = {
             'image': ['jpg', 'jpeg', 'png', 'gif', 'webp'],
             'document': ['pdf', 'txt', 'csv', 'json', 'xlsx', 'docx'],
             'code': ['py', 'js', 'html', 'css', 'json', 'xml']
         }
+        
+        # Reverse lookup of extension to category; the first category listed
+        # wins, so json is treated as a document
+        self._ext_to_category = {}
+        for category, extensions in self.supported_file_types.items():
+            for extension in extensions:
+                self._ext_to_category.setdefault(extension, category)
+        
         self.temp_files = []
+        
+        # Extracted text keyed by content hash and file type, so the same
+        # bytes are only parsed once per processor
+        self._text_cache = OrderedDict()
+    
+    @property
+    def settings(self):
+        """Gemini Assistant Settings, read from the document cache on each use
+        so a reused processor sees changes."""
+        return frappe.get_cached_doc("Gemini Assistant Settings")
     
-    def process_file(self, file_path=None, file_url=None, file_content=None, file_type=None):
+    def process_file(self, file_path=None, file_url=None, file_content=None, file_type=None, extract_text=True):
         """
         Process a file for analysis by Gemini.
         
@@ -39,6 +224,9 @@ class FileProcessor:
             file_url (str, optional): File URL
             file_content (bytes, optional): Raw file content
             file_type (str, optional): File type hint
+            extract_text (bool, optional): Whether to extract document text. Callers
+                that only pass the file on to Gemini can set this to False to skip
+                parsing; text_content is then None.
             
         Returns:
             dict: Processed file data
@@ -55,11 +243,12 @@ class FileProcessor:
                 return {"error": "Could not retrieve file content", "success": False}
             
             # Process based on file type
-            if detected_type in self.supported_file_types['image']:
+            category = self._ext_to_category.get(detected_type)
+            if category == 'image':
                 return self._process_image(content, detected_type)
-            elif detected_type in self.supported_file_types['document']:
-                return self._process_document(content, detected_type)
-            elif detected_type in self.supported_file_types['code']:
+            elif category == 'document':
+                return self._process_document(content, detected_type, extract_text=extract_text)
+            elif category == 'code':
                 return self._process_code(content, detected_type)
             else:
                 return {"error": f"Unsupported file type: {detected_type}", "success": False}
@@ -138,6 +327,68 @@ class FileProcessor:
             frappe.log_error(f"Error processing attachment: {str(e)}")
             raise GeminiFileProcessingError(f"Error processing attachment: {str(e)}")
     
+    def process_many(self, inputs):
+        """
+        Process several files, downloading remote files concurrently.
+        
+        Only the downloads run in worker threads, since they need neither the
+        database nor frappe.local. Processing, including audit logging, then
+        happens on the calling thread.
+        
+        Args:
+            inputs (list): process_file keyword arguments, one dict per file
+            
+        Returns:
+            list: Processed file data, in the same order as inputs
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        
+        # Remote URLs not already resolved to content
+        remote = {
+            index: kwargs["file_url"]
+            for index, kwargs in enumerate(inputs)
+            if kwargs.get("file_url") and not kwargs["file_url"].startswith('/')
+            and not kwargs.get("file_path") and not kwargs.get("file_content")
+        }
+        
+        downloads = {}
+        if remote and self.settings.enable_file_processing:
+            max_size = self._get_max_remote_file_size()
+            
+            # Create the shared session before the workers start
+            _get_http_session()
+            
+            with ThreadPoolExecutor(max_workers=min(_MAX_DOWNLOAD_WORKERS, len(remote))) as executor:
+                futures = {
+                    index: executor.submit(self._download_remote_file, file_url, max_size)
+                    for index, file_url in remote.items()
+                }
+            
+            for index, future in futures.items():
+                try:
+                    downloads[index] = future.result()
+                except Exception as e:
+                    downloads[index] = e
+        
+        results = []
+        for index, kwargs in enumerate(inputs):
+            if index not in downloads:
+                results.append(self.process_file(**kwargs))
+                continue
+            
+            content = downloads[index]
+            if isinstance(content, Exception):
+                frappe.log_error(f"Error downloading file {remote[index]}: {str(content)}")
+                results.append({"error": f"Error downloading file: {str(content)}", "success": False})
+                continue
+            
+            kwargs = dict(kwargs, file_content=content)
+            kwargs.pop("file_url")
+            kwargs["file_type"] = kwargs.get("file_type") or remote[index].split('.')[-1].lower()
+            results.append(self.process_file(**kwargs))
+        
+        return results
+    
     def extract_text_from_document(self, file_path=None, file_url=None, file_content=None):
         """
         Extract text content from a document file.
@@ -157,23 +408,14 @@ class FileProcessor:
             if not content:
                 return ""
             
-            # Process based on file type
-            if detected_type == 'pdf':
-                return self._extract_text_from_pdf(content)
-            elif detected_type == 'txt':
-                return content.decode('utf-8', errors='ignore')
-            elif detected_type == 'csv':
-                return self._extract_text_from_csv(content)
-            elif detected_type == 'json':
-                return self._extract_text_from_json(content)
-            elif detected_type in ['xlsx', 'docx']:
-                return self._extract_text_from_office(content, detected_type)
-            else:
-                return ""
+            return self._extract_text(content, detected_type)
                 
         except Exception as e:
             frappe.log_error(f"Error extracting text from document: {str(e)}")
             return ""
+        finally:
+            # Clean up temporary files
+            self._cleanup_temp_files()
     
     def _get_file_content(self, file_path=None, file_url=None, file_content=None, file_type=None):
         """
@@ -211,9 +453,7 @@ class FileProcessor:
                         content = f.read()
             else:
                 # Remote URL
-                import requests
-                response = requests.get(file_url)
-                content = response.content
+                content = self._download_remote_file(file_url)
             
             if not detected_type:
                 detected_type = file_url.split('.')[-1].lower()
@@ -224,17 +464,44 @@ class FileProcessor:
             
             if not detected_type:
                 # Try to detect type from content
-                import magic
-                mime = magic.Magic(mime=True)
-                mime_type = mime.from_buffer(content)
-                
-                # Convert MIME type to extension
-                extension = mimetypes.guess_extension(mime_type)
-                if extension:
-                    detected_type = extension.lstrip('.').lower()
+                detected_type = _sniff_file_type(content)
         
         return content, detected_type
     
+    def _download_remote_file(self, file_url, max_size=None):
+        """
+        Download a remote file in chunks, aborting once it exceeds the size limit.
+        
+        Args:
+            file_url (str): Remote file URL
+            max_size (int, optional): Size limit in bytes. Read from settings if not given.
+            
+        Returns:
+            bytes: File content
+        """
+        from io import BytesIO
+        
+        if max_size is None:
+            max_size = self._get_max_remote_file_size()
+        
+        with _get_http_session().get(file_url, stream=True, timeout=_REMOTE_TIMEOUT) as response:
+            response.raise_for_status()
+            
+            buffer = BytesIO()
+            total = 0
+            for chunk in response.iter_content(_REMOTE_CHUNK_SIZE):
+                total += len(chunk)
+                if total > max_size:
+                    raise GeminiFileProcessingError(f"Remote file exceeds the {max_size // (1024 * 1024)} MB limit")
+                
+                buffer.write(chunk)
+            
+            return buffer.getvalue()
+    
+    def _get_max_remote_file_size(self):
+        """Return the remote download size limit in bytes."""
+        return (cint(self.settings.get("max_remote_file_size")) or _DEFAULT_MAX_REMOTE_FILE_SIZE) * 1024 * 1024
+    
     def _process_image(self, content, file_type):
         """
         Process an image file.
@@ -248,23 +515,22 @@ class FileProcessor:
         """
         try:
             # Create temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_type}')
-            temp_file.write(content)
-            temp_file.close()
+            temp_path = self._write_temp_file(content, file_type)
             
-            # Add to temp files list for cleanup
-            self.temp_files.append(temp_file.name)
+            # Get image dimensions from the headers, falling back to PIL
+            dimensions = _image_dimensions(content)
+            if not dimensions:
+                from PIL import Image
+                from io import BytesIO
+                dimensions = Image.open(BytesIO(content)).size
             
-            # Get image dimensions
-            from PIL import Image
-            img = Image.open(temp_file.name)
-            width, height = img.size
+            width, height = dimensions
             
             # Log the processing
             self._log_file_processing('image', file_type, len(content))
             
             return {
-                "file_path": temp_file.name,
+                "file_path": temp_path,
                 "file_type": file_type,
                 "mime_type": f"image/{file_type}",
                 "width": width,
@@ -277,46 +543,34 @@ class FileProcessor:
             frappe.log_error(f"Error processing image: {str(e)}")
             return {"error": f"Error processing image: {str(e)}", "success": False}
     
-    def _process_document(self, content, file_type):
+    def _process_document(self, content, file_type, extract_text=True):
         """
         Process a document file.
         
         Args:
             content (bytes): Document file content
             file_type (str): Document file type
+            extract_text (bool, optional): Whether to extract the document text
             
         Returns:
             dict: Processed document data
         """
         try:
             # Create temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_type}')
-            temp_file.write(content)
-            temp_file.close()
-            
-            # Add to temp files list for cleanup
-            self.temp_files.append(temp_file.name)
-            
-            # Extract text based on file type
-            text = ""
-            if file_type == 'pdf':
-                text = self._extract_text_from_pdf(content)
-            elif file_type == 'txt':
-                text = content.decode('utf-8', errors='ignore')
-            elif file_type == 'csv':
-                text = self._extract_text_from_csv(content)
-            elif file_type == 'json':
-                text = self._extract_text_from_json(content)
-            elif file_type in ['xlsx', 'docx']:
-                text = self._extract_text_from_office(content, file_type)
+            temp_path = self._write_temp_file(content, file_type)
+            
+            # Extract text, reusing the temporary file
+            text = None
+            if extract_text:
+                text = self._extract_text(content, file_type, path=temp_path)
             
             # Log the processing
             self._log_file_processing('document', file_type, len(content))
             
             return {
-                "file_path": temp_file.name,
+                "file_path": temp_path,
                 "file_type": file_type,
-                "mime_type": mimetypes.guess_type(f"file.{file_type}")[0],
+                "mime_type": _EXT_TO_MIME.get(file_type, "application/octet-stream"),
                 "text_content": text,
                 "size": len(content),
                 "success": True
@@ -342,20 +596,15 @@ class FileProcessor:
             text = content.decode('utf-8', errors='ignore')
             
             # Create temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_type}')
-            temp_file.write(content)
-            temp_file.close()
-            
-            # Add to temp files list for cleanup
-            self.temp_files.append(temp_file.name)
+            temp_path = self._write_temp_file(content, file_type)
             
             # Log the processing
             self._log_file_processing('code', file_type, len(content))
             
             return {
-                "file_path": temp_file.name,
+                "file_path": temp_path,
                 "file_type": file_type,
-                "mime_type": mimetypes.guess_type(f"file.{file_type}")[0],
+                "mime_type": _EXT_TO_MIME.get(file_type, "application/octet-stream"),
                 "text_content": text,
                 "size": len(content),
                 "success": True
@@ -365,36 +614,86 @@ class FileProcessor:
             frappe.log_error(f"Error processing code: {str(e)}")
             return {"error": f"Error processing code: {str(e)}", "success": False}
     
-    def _extract_text_from_pdf(self, content):
+    def _extract_text(self, content, file_type, path=None):
+        """
+        Extract text from a document, memoized per content and file type.
+        
+        Args:
+            content (bytes): Document file content
+            file_type (str): Document file type
+            path (str, optional): Path of a file already holding the content
+            
+        Returns:
+            str: Extracted text
+        """
+        import hashlib
+        
+        key = (hashlib.blake2b(content, digest_size=16).digest(), file_type)
+        if key in self._text_cache:
+            self._text_cache.move_to_end(key)
+            return self._text_cache[key]
+        
+        # Extract text based on file type
+        text = ""
+        if file_type == 'pdf':
+            text = self._extract_text_from_pdf(content, path=path)
+        elif file_type == 'txt':
+            text = content.decode('utf-8', errors='ignore')
+        elif file_type == 'csv':
+            text = self._extract_text_from_csv(content)
+        elif file_type == 'json':
+            text = self._extract_text_from_json(content)
+        elif file_type in ['xlsx', 'docx']:
+            # Office readers need a file on disk
+            text = self._extract_text_from_office(path or self._write_temp_file(content, file_type), file_type)
+        
+        self._text_cache[key] = text
+        
+        # Evict the least recently used entries
+        while len(self._text_cache) > _TEXT_CACHE_SIZE:
+            self._text_cache.popitem(last=False)
+        
+        return text
+    
+    def _extract_text_from_pdf(self, content, path=None):
         """
         Extract text from a PDF file.
         
         Args:
             content (bytes): PDF file content
+            path (str, optional): Path of a file already holding the content
             
         Returns:
             str: Extracted text
         """
         try:
-            import PyPDF2
-            from io import BytesIO
-            
-            # Create PDF reader
-            pdf_file = BytesIO(content)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            
-            # Extract text from all pages
-            text = ""
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n\n"
-            
-            return text
+            # Join once at the end instead of growing a string per page
+            return "\n\n".join(self._iter_pdf_pages(content, path=path))
             
         except Exception as e:
             frappe.log_error(f"Error extracting text from PDF: {str(e)}")
             return ""
     
+    def _iter_pdf_pages(self, content, path=None):
+        """
+        Yield the text of a PDF one page at a time.
+        
+        Args:
+            content (bytes): PDF file content
+            path (str, optional): Path of a file already holding the content
+            
+        Yields:
+            str: Extracted text of each page
+        """
+        import PyPDF2
+        from io import BytesIO
+        
+        # Read from disk when possible so the reader seeks the file directly
+        pdf_reader = PyPDF2.PdfReader(path if path else BytesIO(content))
+        
+        for page in pdf_reader.pages:
+            yield page.extract_text() or ""
+    
     def _extract_text_from_csv(self, content):
         """
         Extract text from a CSV file.
@@ -408,6 +707,7 @@ class FileProcessor:
         try:
             import csv
             from io import StringIO
+            from itertools import islice
             
             # Decode content
             text = content.decode('utf-8', errors='ignore')
@@ -416,12 +716,13 @@ class FileProcessor:
             csv_file = StringIO(text)
             csv_reader = csv.reader(csv_file)
             
-            # Convert to formatted text
-            formatted_text = ""
-            for row in csv_reader:
-                formatted_text += " | ".join(row) + "\n"
+            # Convert to formatted text, joining once instead of per row
+            lines = [" | ".join(row) for row in islice(csv_reader, _MAX_CSV_ROWS)]
             
-            return formatted_text
+            if next(csv_reader, None) is not None:
+                lines.append(f"... (truncated after {_MAX_CSV_ROWS} rows)")
+            
+            return "".join(f"{line}\n" for line in lines)
             
         except Exception as e:
             frappe.log_error(f"Error extracting text from CSV: {str(e)}")
@@ -438,14 +739,15 @@ class FileProcessor:
             str: Extracted text
         """
         try:
-            # Decode content
-            text = content.decode('utf-8', errors='ignore')
+            # Reject oversized files before decoding or parsing them
+            if len(content) > _MAX_JSON_SIZE:
+                return "Error: JSON file exceeds size limit"
             
-            # Parse JSON
-            data = json.loads(text)
+            # Parse JSON; json.loads accepts the raw bytes directly
+            data = json.loads(content)
             
-            # Format as pretty JSON
-            formatted_text = json.dumps(data, indent=2)
+            # Format as pretty JSON, with orjson when it is installed
+            formatted_text = dumps_details(data, pretty=True)
             
             return formatted_text
             
@@ -453,40 +755,39 @@ class FileProcessor:
             frappe.log_error(f"Error extracting text from JSON: {str(e)}")
             return ""
     
-    def _extract_text_from_office(self, content, file_type):
+    def _extract_text_from_office(self, path, file_type):
         """
         Extract text from Office documents (XLSX, DOCX).
         
         Args:
-            content (bytes): Office document content
+            path (str): Path of the Office document on disk
             file_type (str): Office document type
             
         Returns:
             str: Extracted text
         """
         try:
-            # Create temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_type}')
-            temp_file.write(content)
-            temp_file.close()
-            
-            # Add to temp files list for cleanup
-            self.temp_files.append(temp_file.name)
-            
             if file_type == 'xlsx':
-                import pandas as pd
+                from openpyxl import load_workbook
                 
-                # Read Excel file
-                df = pd.read_excel(temp_file.name)
+                # Stream the cell values without building a full workbook model
+                workbook = load_workbook(path, read_only=True, data_only=True)
+                try:
+                    lines = []
+                    for sheet in workbook.worksheets:
+                        lines.append(f"# {sheet.title}")
+                        for row in sheet.iter_rows(values_only=True):
+                            lines.append(" | ".join("" if cell is None else str(cell) for cell in row))
+                finally:
+                    workbook.close()
                 
-                # Convert to string
-                return df.to_string()
+                return "\n".join(lines)
                 
             elif file_type == 'docx':
                 import docx
                 
                 # Read Word document
-                doc = docx.Document(temp_file.name)
+                doc = docx.Document(path)
                 
                 # Extract text
                 text = ""
@@ -501,6 +802,31 @@ class FileProcessor:
             frappe.log_error(f"Error extracting text from Office document: {str(e)}")
             return ""
     
+    def _write_temp_file(self, content, file_type):
+        """
+        Write content to a temporary file registered for cleanup.
+        
+        Args:
+            content (bytes): File content
+            file_type (str): File type, used as the file suffix
+            
+        Returns:
+            str: Path of the temporary file
+        """
+        # Write straight to the descriptor, bypassing Python's buffered I/O
+        fd, path = tempfile.mkstemp(suffix=f'.{file_type}')
+        try:
+            view = memoryview(content)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        
+        # Add to temp files list for cleanup
+        self.temp_files.append(path)
+        
+        return path
+    
     def _cleanup_temp_files(self):
         """Clean up temporary files."""
         for file_path in self.temp_files:
@@ -523,24 +849,16 @@ class FileProcessor:
             file_size (int): File size in bytes
         """
         try:
-            audit_log = frappe.get_doc({
-                "doctype": "Gemini Audit Log",
-                "timestamp": now_datetime(),
-                "user": frappe.session.user,
-                "action_type": "Function Call",
-                "details": json.dumps({
-                    "function": "file_processor",
-                    "file_category": file_category,
-                    "file_type": file_type,
-                    "file_size": file_size,
-                    "timestamp": str(now_datetime())
-                }),
-                "status": "Success",
-                "ip_address": frappe.local.request_ip if hasattr(frappe.local, "request_ip") else "127.0.0.1"
+            # No frappe.db.commit() here: it would flush the caller's whole
+            # transaction. The background job writes the row in its own
+            # transaction once the request commits.
+            enqueue_audit_log("Function Call", {
+                "function": "file_processor",
+                "file_category": file_category,
+                "file_type": file_type,
+                "file_size": file_size,
+                "timestamp": str(now_datetime())
             })
             
-            audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
-            
         except Exception as e:
             frappe.log_error(f"Error logging file processing: {str(e)}")
@@ -3,13 +3,52 @@
 # For license information, please see license.txt
 
 import frappe
+import re
 import json
+from operator import eq, ne, gt, lt
 from frappe import _
 from frappe.utils import now_datetime, cint
 from ..gemini.client import GeminiClient
 from ..gemini.prompt_builder import PromptBuilder
 from ..gemini.response_parser import ResponseParser
 from ..gemini.exceptions import GeminiWorkflowError
+from .audit import enqueue_audit_log
+
+# "{fieldname}" placeholders in rule parameters and prompt templates
+_PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+
+# Sentinel for fields missing from a document
+_MISSING = object()
+
+# Condition operators, called as fn(field_value, value)
+_CONDITION_OPERATORS = {
+    "equals": eq,
+    "not_equals": ne,
+    "greater_than": gt,
+    "less_than": lt,
+    "contains": lambda field_value, value: value in str(field_value),
+    "not_contains": lambda field_value, value: value not in str(field_value),
+    "is_empty": lambda field_value, value: not field_value,
+    "is_not_empty": lambda field_value, value: bool(field_value),
+}
+
+def _doc_to_str_dict(doc):
+    """
+    Get the non-empty field values of a document as strings.
+    
+    Args:
+        doc (object): Document object
+        
+    Returns:
+        dict: Field values keyed by fieldname
+    """
+    doc_fields = {}
+    for field in doc.meta.fields:
+        value = doc.get(field.fieldname)
+        if value is not None:
+            doc_fields[field.fieldname] = str(value)
+    
+    return doc_fields
 
 class RoleBasedAutomation:
     """
@@ -21,10 +60,11 @@ class RoleBasedAutomation:
     
     def __init__(self):
         """Initialize the role-based automation manager."""
-        self.settings = frappe.get_single("Gemini Assistant Settings")
+        self.settings = frappe.get_cached_doc("Gemini Assistant Settings")
         self.client = GeminiClient()
         self.prompt_builder = PromptBuilder()
         self.response_parser = ResponseParser()
+        self._rule_index = None
     
     def get_applicable_rules(self, doctype, event, user=None):
         """
@@ -43,38 +83,41 @@ class RoleBasedAutomation:
             if not self.settings.enable_workflow_automation:
                 return []
             
-            # Get user roles
             user = user or frappe.session.user
-            user_roles = frappe.get_roles(user)
             
-            # Get all automation rules
-            rules = self._get_automation_rules()
+            # Reuse the result for repeated events within the same request
+            rule_cache = getattr(frappe.local, "gemini_rule_cache", None)
+            if rule_cache is None:
+                rule_cache = frappe.local.gemini_rule_cache = {}
+            
+            cache_key = (doctype, event, user)
+            if cache_key in rule_cache:
+                return list(rule_cache[cache_key])
             
-            # Filter rules by doctype, event, and user roles
+            # Get user roles
+            user_roles = frozenset(frappe.get_roles(user))
+            
+            # Get the rules for this doctype and event, including wildcard rules,
+            # in their original order
+            rule_index = self._get_rule_index()
+            keys = {(doctype, event), ("*", event), (doctype, "*"), ("*", "*")}
+            candidates = sorted(
+                (entry for key in keys for entry in rule_index.get(key, ())),
+                key=lambda entry: entry[0]
+            )
+            
+            # Filter rules by user roles
             applicable_rules = []
             
-            for rule in rules:
-                # Check if rule applies to this doctype
-                if rule.get("doctype") != doctype and rule.get("doctype") != "*":
-                    continue
-                
-                # Check if rule applies to this event
-                if rule.get("event") != event and rule.get("event") != "*":
-                    continue
-                
+            for _, rule, allowed_roles in candidates:
                 # Check if user has required role
-                role_match = False
-                for role in user_roles:
-                    if role in rule.get("allowed_roles", []) or role == "Administrator":
-                        role_match = True
-                        break
-                
-                if not role_match:
+                if user_roles.isdisjoint(allowed_roles):
                     continue
                 
                 # Rule is applicable
                 applicable_rules.append(rule)
             
+            rule_cache[cache_key] = tuple(applicable_rules)
             return applicable_rules
             
         except Exception as e:
@@ -124,11 +167,21 @@ class RoleBasedAutomation:
                     })
                 
                 elif action_type == "ai_decision":
-                    # Make AI-driven decision
-                    decision_result = self._make_ai_decision(action, doc, event, user)
+                    # Make the AI-driven decision in the background so the
+                    # document save does not wait on the Gemini API
+                    frappe.enqueue(
+                        "erpnext_gemini_integration.utils.role_based_automation.run_ai_decision",
+                        queue="long",
+                        enqueue_after_commit=True,
+                        action=action,
+                        doctype=doc.doctype,
+                        docname=doc.name,
+                        event=event,
+                        user=user
+                    )
                     results.append({
                         "type": "ai_decision",
-                        "result": decision_result
+                        "result": {"queued": True}
                     })
                 
                 elif action_type == "condition":
@@ -197,8 +250,9 @@ class RoleBasedAutomation:
             
             # Save rule
             # In a real implementation, this would save to a custom DocType
-            # For now, we'll just log it
-            frappe.log_error(f"Created rule: {json.dumps(rule)}")
+            # For now, we'll just log it to the app's file log; the Error Log
+            # is reserved for failures
+            frappe.logger("erpnext_gemini_integration").info(f"Created rule: {json.dumps(rule)}")
             
             # Log the rule creation
             self._log_rule_creation(rule)
@@ -212,6 +266,27 @@ class RoleBasedAutomation:
             frappe.log_error(f"Error creating rule: {str(e)}")
             return {"success": False, "error": str(e)}
     
+    def _get_rule_index(self):
+        """
+        Get the automation rules indexed by (doctype, event), built once per instance.
+        
+        Returns:
+            dict: Lists of (position, rule, allowed roles) tuples keyed by (doctype, event)
+        """
+        if self._rule_index is None:
+            rule_index = {}
+            for position, rule in enumerate(self._get_automation_rules()):
+                key = (rule.get("doctype"), rule.get("event"))
+                
+                # Administrators may trigger every rule
+                allowed_roles = frozenset(rule.get("allowed_roles", [])) | {"Administrator"}
+                
+                rule_index.setdefault(key, []).append((position, rule, allowed_roles))
+            
+            self._rule_index = rule_index
+        
+        return self._rule_index
+    
     def _get_automation_rules(self):
         """
         Get all automation rules.
@@ -276,16 +351,17 @@ class RoleBasedAutomation:
         # Create a copy of params
         new_params = {}
         
+        # Read the document fields once for all parameters
+        doc_fields = None
+        
         # Replace placeholders in each parameter
         for key, value in params.items():
             if isinstance(value, str):
-                # Replace placeholders in string
-                for field in doc.meta.fields:
-                    if hasattr(doc, field.fieldname):
-                        field_value = doc.get(field.fieldname)
-                        if field_value is not None:
-                            placeholder = f"{{{field.fieldname}}}"
-                            value = value.replace(placeholder, str(field_value))
+                if doc_fields is None:
+                    doc_fields = _doc_to_str_dict(doc)
+                
+                # Replace placeholders in a single pass, leaving unknown ones as-is
+                value = _PLACEHOLDER_RE.sub(lambda m: doc_fields.get(m.group(1), m.group(0)), value)
             
             new_params[key] = value
         
@@ -319,19 +395,12 @@ class RoleBasedAutomation:
             }
             
             # Add document fields
-            doc_fields = {}
-            for field in doc.meta.fields:
-                if hasattr(doc, field.fieldname):
-                    value = doc.get(field.fieldname)
-                    if value is not None:
-                        doc_fields[field.fieldname] = str(value)
+            doc_fields = _doc_to_str_dict(doc)
             
             context["document_data"] = doc_fields
             
-            # Replace placeholders in prompt template
-            for field, value in doc_fields.items():
-                placeholder = f"{{{field}}}"
-                prompt_template = prompt_template.replace(placeholder, value)
+            # Replace placeholders in prompt template in a single pass
+            prompt_template = _PLACEHOLDER_RE.sub(lambda m: doc_fields.get(m.group(1), m.group(0)), prompt_template)
             
             # Build prompt
             if decision_type == "classification":
@@ -351,16 +420,15 @@ class RoleBasedAutomation:
             decision = parsed_response["content"].strip()
             
             if decision_type == "classification":
-                # Find closest match in options
+                # Find closest match in options: the longest option contained
+                # in the decision, the first listed winning ties
+                decision_lower = decision.lower()
                 best_match = None
-                best_score = 0
                 
-                for option in options:
-                    if option.lower() in decision.lower():
-                        score = len(option)
-                        if score > best_score:
-                            best_match = option
-                            best_score = score
+                for option in sorted(options, key=len, reverse=True):
+                    if option and option.lower() in decision_lower:
+                        best_match = option
+                        break
                 
                 if best_match:
                     decision = best_match
@@ -399,33 +467,16 @@ class RoleBasedAutomation:
             value = action.get("value")
             
             # Get field value
-            if not hasattr(doc, field):
+            field_value = getattr(doc, field, _MISSING) if field else _MISSING
+            if field_value is _MISSING:
                 return {
                     "condition_met": False,
                     "error": f"Field '{field}' not found in document"
                 }
             
-            field_value = doc.get(field)
-            
-            # Evaluate condition
-            condition_met = False
-            
-            if operator == "equals":
-                condition_met = field_value == value
-            elif operator == "not_equals":
-                condition_met = field_value != value
-            elif operator == "greater_than":
-                condition_met = field_value > value
-            elif operator == "less_than":
-                condition_met = field_value < value
-            elif operator == "contains":
-                condition_met = value in str(field_value)
-            elif operator == "not_contains":
-                condition_met = value not in str(field_value)
-            elif operator == "is_empty":
-                condition_met = not field_value
-            elif operator == "is_not_empty":
-                condition_met = bool(field_value)
+            # Evaluate condition; unknown operators never match
+            evaluate = _CONDITION_OPERATORS.get(operator)
+            condition_met = evaluate(field_value, value) if evaluate else False
             
             return {
                 "condition_met": condition_met,
@@ -450,25 +501,14 @@ class RoleBasedAutomation:
             rule (dict): Rule definition
         """
         try:
-            audit_log = frappe.get_doc({
-                "doctype": "Gemini Audit Log",
-                "timestamp": now_datetime(),
-                "user": frappe.session.user,
-                "action_type": "Rule Creation",
-                "details": json.dumps({
-                    "rule_name": rule["name"],
-                    "doctype": rule["doctype"],
-                    "event": rule["event"],
-                    "allowed_roles": rule["allowed_roles"],
-                    "timestamp": str(now_datetime())
-                }),
-                "status": "Success",
-                "ip_address": frappe.local.request_ip if hasattr(frappe.local, "request_ip") else "127.0.0.1"
+            enqueue_audit_log("Rule Creation", {
+                "rule_name": rule["name"],
+                "doctype": rule["doctype"],
+                "event": rule["event"],
+                "allowed_roles": rule["allowed_roles"],
+                "timestamp": str(now_datetime())
             })
             
-            audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
-            
         except Exception as e:
             frappe.log_error(f"Error logging rule creation: {str(e)}")
     
@@ -481,24 +521,54 @@ class RoleBasedAutomation:
             results (list): Results of rule execution
         """
         try:
-            audit_log = frappe.get_doc({
-                "doctype": "Gemini Audit Log",
-                "timestamp": now_datetime(),
-                "user": frappe.session.user,
-                "action_type": "Rule Execution",
-                "details": json.dumps({
-                    "rule_name": rule["name"],
-                    "doctype": rule["doctype"],
-                    "event": rule["event"],
-                    "actions_executed": len(results),
-                    "timestamp": str(now_datetime())
-                }),
-                "status": "Success",
-                "ip_address": frappe.local.request_ip if hasattr(frappe.local, "request_ip") else "127.0.0.1"
+            enqueue_audit_log("Rule Execution", {
+                "rule_name": rule["name"],
+                "doctype": rule["doctype"],
+                "event": rule["event"],
+                "actions_executed": len(results),
+                "timestamp": str(now_datetime())
             })
             
-            audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
-            
         except Exception as e:
             frappe.log_error(f"Error logging rule execution: {str(e)}")
+
+
+def run_ai_decision(action, doctype, docname, event, user=None):
+    """
+    Make an AI-driven decision for a rule action. Runs as a background job.
+    
+    The decision is recorded in the audit log and published to the user as
+    a "gemini_ai_decision" realtime event.
+    
+    Args:
+        action (dict): AI decision action definition
+        doctype (str): DocType of the document
+        docname (str): Name of the document
+        event (str): Event type
+        user (str, optional): User who triggered the event
+        
+    Returns:
+        dict: Result of AI decision
+    """
+    doc = frappe.get_doc(doctype, docname)
+    result = RoleBasedAutomation()._make_ai_decision(action, doc, event, user)
+    
+    enqueue_audit_log("Function Call", {
+        "function": "role_based_automation",
+        "action": "ai_decision",
+        "doctype": doctype,
+        "docname": docname,
+        "event": event,
+        "decision_type": result.get("decision_type"),
+        "decision": result.get("decision"),
+        "error": result.get("error"),
+        "timestamp": str(now_datetime())
+    }, status="Error" if result.get("error") else "Success")
+    
+    frappe.publish_realtime(
+        event="gemini_ai_decision",
+        message={"doctype": doctype, "docname": docname, "event": event, "result": result},
+        user=user or frappe.session.user
+    )
+    
+    return result
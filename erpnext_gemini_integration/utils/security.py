@@ -4,9 +4,70 @@
 
 import frappe
 import re
-import json
+from functools import lru_cache
 from frappe import _
-from frappe.utils import now_datetime, cint
+from frappe.utils import cint
+from .audit import enqueue_audit_log
+
+# Default masks for common personal data, fused into two passes. Card
+# numbers are masked in the first pass so a phone or SSN match starting
+# earlier in a run of digits cannot split one; alternatives are tried in
+# order at each position.
+_PII_PATTERNS = (
+    ("email", r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', '[EMAIL REDACTED]'),
+    ("credit_card", r'\b(?:\d{4}[-\s]?){3}\d{4}\b', '[CREDIT CARD REDACTED]'),
+    ("phone", r'\b(?:\+\d{1,3}[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}\b', '[PHONE REDACTED]'),
+    ("ssn", r'\b\d{3}[-\s]?\d{2}[-\s]?\d{4}\b', '[SSN REDACTED]'),
+)
+
+def _fuse_pii_patterns(names):
+    """Join the named default masks into one alternation of named groups."""
+    return re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern, _ in _PII_PATTERNS if name in names))
+
+_PII_PASSES = (
+    _fuse_pii_patterns(("email", "credit_card")),
+    _fuse_pii_patterns(("phone", "ssn")),
+)
+_PII_REPLACEMENTS = {name: replacement for name, _, replacement in _PII_PATTERNS}
+
+# Every default mask needs an "@" or a digit to match
+_DIGIT_RE = re.compile(r'\d')
+
+def _pii_replacement(match):
+    """Return the redaction text for whichever default mask matched."""
+    return _PII_REPLACEMENTS[match.lastgroup]
+
+_SENSITIVE_KEYWORDS_CACHE_KEY = "gemini_sensitive_keywords"
+
+def get_sensitive_keyword_rows():
+    """
+    Get the enabled sensitive keywords, cached in Redis until one changes.
+    
+    Returns:
+        list: Gemini Sensitive Keyword rows
+    """
+    return frappe.cache().get_value(
+        _SENSITIVE_KEYWORDS_CACHE_KEY,
+        generator=lambda: frappe.get_all(
+            "Gemini Sensitive Keyword",
+            filters={"enabled": 1},
+            fields=["keyword_pattern", "replacement_pattern", "is_global", "specific_doctypes", "specific_fields"]
+        )
+    )
+
+def clear_sensitive_keywords_cache():
+    """Drop the cached sensitive keywords. Called when a keyword is saved or deleted."""
+    frappe.cache().delete_value(_SENSITIVE_KEYWORDS_CACHE_KEY)
+    clear_request_security_manager()
+
+def clear_request_security_manager():
+    """Drop the SecurityManager reused by mask_sensitive_data for the current request."""
+    frappe.local.gemini_security_manager = None
+
+@lru_cache(maxsize=256)
+def _compile_keyword_pattern(pattern):
+    """Compile a sensitive keyword pattern; memoized per process."""
+    return re.compile(pattern)
 
 class SecurityManager:
     """
@@ -18,8 +79,15 @@ class SecurityManager:
     
     def __init__(self):
         """Initialize the security manager."""
-        self.settings = frappe.get_single("Gemini Assistant Settings")
+        self.settings = frappe.get_cached_doc("Gemini Assistant Settings")
         self.sensitive_keywords = self._load_sensitive_keywords()
+        self._keywords_by_context = {}
+        
+        # Per-instance lookups reused across fields and documents
+        self._user_roles = frappe.get_roles(frappe.session.user)
+        self._meta_cache = {}
+        self._doctype_perm_cache = {}
+        self._role_perms_cache = {}
     
     def _load_sensitive_keywords(self):
         """
@@ -30,15 +98,20 @@ class SecurityManager:
         """
         try:
             keywords = []
-            keyword_docs = frappe.get_all(
-                "Gemini Sensitive Keyword",
-                filters={"enabled": 1},
-                fields=["keyword_pattern", "replacement_pattern", "is_global", "specific_doctypes", "specific_fields"]
-            )
+            keyword_docs = get_sensitive_keyword_rows()
             
             for kw in keyword_docs:
+                # Compile once here instead of on every mask call, and check
+                # the replacement template against it (re parses it eagerly)
+                try:
+                    pattern = _compile_keyword_pattern(kw.keyword_pattern)
+                    pattern.sub(kw.replacement_pattern, "")
+                except (re.error, TypeError) as e:
+                    frappe.log_error(f"Invalid sensitive keyword pattern {kw.keyword_pattern!r}: {str(e)}")
+                    continue
+                
                 keywords.append({
-                    "pattern": kw.keyword_pattern,
+                    "pattern": pattern,
                     "replacement": kw.replacement_pattern,
                     "is_global": cint(kw.is_global),
                     "doctypes": kw.specific_doctypes,
@@ -68,58 +141,52 @@ class SecurityManager:
         masked_text = text
         
         # Apply configured sensitive keywords
-        for keyword in self.sensitive_keywords:
-            # Check if keyword applies to this context
-            if not keyword["is_global"]:
-                # Skip if doctype doesn't match
-                if doctype and keyword["doctypes"] and doctype not in keyword["doctypes"]:
-                    continue
-                    
-                # Skip if field doesn't match
-                if field and keyword["fields"] and field not in keyword["fields"]:
-                    continue
-            
-            try:
-                # Apply the regex pattern
-                masked_text = re.sub(
-                    keyword["pattern"],
-                    keyword["replacement"],
-                    masked_text
-                )
-            except Exception as e:
-                frappe.log_error(f"Error applying sensitive keyword pattern: {str(e)}")
+        for keyword in self._get_applicable_keywords(doctype, field):
+            # Apply the regex pattern; patterns were validated when loaded
+            masked_text = keyword["pattern"].sub(keyword["replacement"], masked_text)
         
         # Apply default masking for common patterns if enabled
         if self.settings.enable_role_based_security:
-            # Mask email addresses
-            masked_text = re.sub(
-                r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
-                '[EMAIL REDACTED]',
-                masked_text
-            )
-            
-            # Mask phone numbers
-            masked_text = re.sub(
-                r'\b(?:\+\d{1,3}[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}\b',
-                '[PHONE REDACTED]',
-                masked_text
-            )
+            # Mask email addresses, phone, credit card and SSN/SIN numbers,
+            # skipping the scan for text that cannot contain any of them
+            if "@" in masked_text or _DIGIT_RE.search(masked_text):
+                for pii_re in _PII_PASSES:
+                    masked_text = pii_re.sub(_pii_replacement, masked_text)
+        
+        return masked_text
+    
+    def _get_applicable_keywords(self, doctype, field):
+        """
+        Get the sensitive keywords that apply to a doctype and field, in configured order.
+        
+        The filtered list is built once per context and reused for later calls.
+        
+        Args:
+            doctype (str): Current doctype context
+            field (str): Current field context
             
-            # Mask credit card numbers
-            masked_text = re.sub(
-                r'\b(?:\d{4}[-\s]?){3}\d{4}\b',
-                '[CREDIT CARD REDACTED]',
-                masked_text
-            )
+        Returns:
+            list: Applicable sensitive keyword configurations
+        """
+        key = (doctype, field)
+        if key not in self._keywords_by_context:
+            applicable = []
+            for keyword in self.sensitive_keywords:
+                # Check if keyword applies to this context
+                if not keyword["is_global"]:
+                    # Skip if doctype doesn't match
+                    if doctype and keyword["doctypes"] and doctype not in keyword["doctypes"]:
+                        continue
+                        
+                    # Skip if field doesn't match
+                    if field and keyword["fields"] and field not in keyword["fields"]:
+                        continue
+                
+                applicable.append(keyword)
             
-            # Mask SSN/SIN numbers
-            masked_text = re.sub(
-                r'\b\d{3}[-\s]?\d{2}[-\s]?\d{4}\b',
-                '[SSN REDACTED]',
-                masked_text
-            )
+            self._keywords_by_context[key] = applicable
         
-        return masked_text
+        return self._keywords_by_context[key]
     
     def check_field_permission(self, doctype, field, perm_type="read"):
         """
@@ -135,18 +202,15 @@ class SecurityManager:
         """
         try:
             # Check if user has permission for the doctype
-            if not frappe.has_permission(doctype, perm_type):
+            if not self._has_doctype_permission(doctype, perm_type):
                 return False
             
-            # Get user roles
-            user_roles = frappe.get_roles(frappe.session.user)
-            
             # Check if System Manager (has all permissions)
-            if "System Manager" in user_roles:
+            if "System Manager" in self._user_roles:
                 return True
             
             # Check field level permissions if available
-            meta = frappe.get_meta(doctype)
+            meta = self._get_meta(doctype)
             field_obj = meta.get_field(field)
             
             if not field_obj:
@@ -162,14 +226,11 @@ class SecurityManager:
                 permlevel = field_obj.permlevel
                 
                 # Check if user has permission at this level
-                has_perm = False
-                for role in user_roles:
-                    role_perms = frappe.permissions.get_role_permissions(doctype, role)
-                    if role_perms.get(f"permlevel_{permlevel}", {}).get(perm_type):
-                        has_perm = True
-                        break
-                
-                return has_perm
+                level_key = f"permlevel_{permlevel}"
+                return any(
+                    role_perms.get(level_key, {}).get(perm_type)
+                    for role_perms in self._get_role_perms(doctype).values()
+                )
             
             # Default to True if no specific field permissions are defined
             return True
@@ -178,6 +239,56 @@ class SecurityManager:
             frappe.log_error(f"Error checking field permission: {str(e)}")
             return False
     
+    def _has_doctype_permission(self, doctype, perm_type):
+        """
+        Check doctype-level permission, memoized per doctype and permission type.
+        
+        Args:
+            doctype (str): DocType to check
+            perm_type (str): Permission type
+            
+        Returns:
+            bool: True if user has permission
+        """
+        key = (doctype, perm_type)
+        if key not in self._doctype_perm_cache:
+            self._doctype_perm_cache[key] = bool(frappe.has_permission(doctype, perm_type))
+        
+        return self._doctype_perm_cache[key]
+    
+    def _get_meta(self, doctype):
+        """
+        Get DocType meta, memoized per instance.
+        
+        Args:
+            doctype (str): DocType name
+            
+        Returns:
+            Meta: DocType meta
+        """
+        if doctype not in self._meta_cache:
+            self._meta_cache[doctype] = frappe.get_meta(doctype)
+        
+        return self._meta_cache[doctype]
+    
+    def _get_role_perms(self, doctype):
+        """
+        Get the permissions of each of the user's roles for a doctype, built once per doctype.
+        
+        Args:
+            doctype (str): DocType name
+            
+        Returns:
+            dict: Role permissions keyed by role
+        """
+        if doctype not in self._role_perms_cache:
+            self._role_perms_cache[doctype] = {
+                role: frappe.permissions.get_role_permissions(doctype, role)
+                for role in self._user_roles
+            }
+        
+        return self._role_perms_cache[doctype]
+    
     def get_safe_document_data(self, doctype, docname, fields=None):
         """
         Get document data with sensitive information masked and permissions checked.
@@ -192,38 +303,120 @@ class SecurityManager:
         """
         try:
             # Check if user has read permission for the doctype
-            if not frappe.has_permission(doctype, "read"):
+            if not self._has_doctype_permission(doctype, "read"):
                 return {"error": "Permission denied", "success": False}
             
-            # Get the document
-            doc = frappe.get_doc(doctype, docname)
+            permitted_fields = self._get_permitted_fields(doctype, fields)
             
-            # Get all fields or specific fields
-            safe_data = {}
-            meta = frappe.get_meta(doctype)
+            # Fetch only the permitted columns in a single query
+            row = frappe.db.get_value(doctype, docname, permitted_fields or ["name"], as_dict=True)
+            if not row:
+                return {"error": f"{doctype} {docname} not found", "success": False}
             
-            field_list = fields if fields else [f.fieldname for f in meta.fields]
+            return {"data": self._mask_row(doctype, row, permitted_fields), "success": True}
             
-            for fieldname in field_list:
-                # Check field permission
-                if not self.check_field_permission(doctype, fieldname):
-                    continue
-                
-                # Get field value
-                if hasattr(doc, fieldname):
-                    value = doc.get(fieldname)
-                    if value is not None:
-                        # Convert to string and mask sensitive data
-                        str_value = str(value)
-                        masked_value = self.mask_sensitive_data(str_value, doctype, fieldname)
-                        safe_data[fieldname] = masked_value
+        except Exception as e:
+            frappe.log_error(f"Error getting safe document data: {str(e)}")
+            return {"error": str(e), "success": False}
+    
+    def get_safe_documents(self, doctype, docnames, fields=None):
+        """
+        Get data of several documents with sensitive information masked and permissions checked.
+        
+        Args:
+            doctype (str): DocType to get
+            docnames (list): Document names
+            fields (list, optional): Specific fields to get
+            
+        Returns:
+            dict: Safe document data keyed by document name
+        """
+        try:
+            # Check if user has read permission for the doctype
+            if not self._has_doctype_permission(doctype, "read"):
+                return {"error": "Permission denied", "success": False}
+            
+            permitted_fields = self._get_permitted_fields(doctype, fields)
             
-            return {"data": safe_data, "success": True}
+            # Fetch all documents in a single query
+            rows = frappe.get_all(
+                doctype,
+                filters={"name": ["in", docnames]},
+                fields=["name"] + [f for f in permitted_fields if f != "name"]
+            )
+            
+            data = {row.name: self._mask_row(doctype, row, permitted_fields) for row in rows}
+            
+            return {"data": data, "success": True}
             
         except Exception as e:
-            frappe.log_error(f"Error getting safe document data: {str(e)}")
+            frappe.log_error(f"Error getting safe documents: {str(e)}")
             return {"error": str(e), "success": False}
     
+    def _get_permitted_fields(self, doctype, fields=None):
+        """
+        Get the fields of a doctype the user may read that are stored as columns.
+        
+        Args:
+            doctype (str): DocType name
+            fields (list, optional): Restrict to these fields
+            
+        Returns:
+            list: Permitted fieldnames
+        """
+        from frappe.model import default_fields, no_value_fields, table_fields
+        
+        # The full permitted list is stable for a user within a request, so
+        # it is shared by every SecurityManager created during the request
+        field_perms = None
+        if not fields:
+            field_perms = getattr(frappe.local, "gemini_field_perms", None)
+            if field_perms is None:
+                field_perms = frappe.local.gemini_field_perms = {}
+            
+            cache_key = (frappe.session.user, doctype)
+            if cache_key in field_perms:
+                return list(field_perms[cache_key])
+        
+        meta = self._get_meta(doctype)
+        columns = {
+            f.fieldname for f in meta.fields
+            if f.fieldtype not in no_value_fields and f.fieldtype not in table_fields
+        }
+        
+        if fields:
+            field_list = [f for f in fields if f in columns or f in default_fields]
+        else:
+            field_list = [f.fieldname for f in meta.fields if f.fieldname in columns]
+        
+        permitted = [f for f in field_list if self.check_field_permission(doctype, f)]
+        
+        if field_perms is not None:
+            field_perms[cache_key] = tuple(permitted)
+        
+        return permitted
+    
+    def _mask_row(self, doctype, row, fields):
+        """
+        Mask the values of a fetched row.
+        
+        Args:
+            doctype (str): DocType of the row
+            row (dict): Fetched values
+            fields (list): Fields to include
+            
+        Returns:
+            dict: Masked values as strings, skipping empty ones
+        """
+        safe_data = {}
+        for fieldname in fields:
+            value = row.get(fieldname)
+            if value is not None:
+                # Convert to string and mask sensitive data
+                safe_data[fieldname] = self.mask_sensitive_data(str(value), doctype, fieldname)
+        
+        return safe_data
+    
     def log_security_event(self, event_type, details, status="Success"):
         """
         Log a security event to the audit log.
@@ -234,22 +427,11 @@ class SecurityManager:
             status (str, optional): Event status. Defaults to "Success".
         """
         try:
-            audit_log = frappe.get_doc({
-                "doctype": "Gemini Audit Log",
-                "timestamp": now_datetime(),
-                "user": frappe.session.user,
-                "action_type": "Function Call",
-                "details": json.dumps({
-                    "function": "security_manager",
-                    "event_type": event_type,
-                    "details": details
-                }),
-                "status": status,
-                "ip_address": frappe.local.request_ip if hasattr(frappe.local, "request_ip") else "127.0.0.1"
-            })
-            
-            audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
+            enqueue_audit_log("Function Call", {
+                "function": "security_manager",
+                "event_type": event_type,
+                "details": details
+            }, status=status)
             
         except Exception as e:
             frappe.log_error(f"Error logging security event: {str(e)}")
@@ -268,5 +450,9 @@ def mask_sensitive_data(text, doctype=None, field=None):
     Returns:
         str: Text with sensitive data masked
     """
-    security_manager = SecurityManager()
+    # Reuse one manager for the rest of the request
+    security_manager = getattr(frappe.local, "gemini_security_manager", None)
+    if security_manager is None:
+        security_manager = frappe.local.gemini_security_manager = SecurityManager()
+    
     return security_manager.mask_sensitive_data(text, doctype, field)
@@ -3,13 +3,85 @@
 # For license information, please see license.txt
 
 import frappe
+import hashlib
 import json
+import re
+from functools import cached_property, lru_cache
 from frappe import _
+from frappe.model import table_fields
 from frappe.utils import now_datetime, cint
 from ..gemini.client import GeminiClient
 from ..gemini.prompt_builder import PromptBuilder
 from ..gemini.response_parser import ResponseParser
 from ..gemini.exceptions import GeminiWorkflowError
+from .audit import enqueue_audit_log, SENSITIVE_KEYS
+
+# Custom action definitions, keyed by action name. Built once at import
+# rather than on every lookup; allowed_roles are frozensets for cheap
+# intersection with a user's roles
+_ACTION_DEFINITIONS = {
+    "send_email": {
+        "name": "send_email",
+        "description": "Send an email to specified recipients",
+        "allowed_roles": frozenset({"System Manager", "Administrator"}),
+        "parameters": ["recipients", "subject", "message"]
+    },
+    "create_task": {
+        "name": "create_task",
+        "description": "Create a new task",
+        "allowed_roles": frozenset({"System Manager", "Administrator"}),
+        "parameters": ["subject", "description", "assigned_to"]
+    }
+}
+
+# "{fieldname}" placeholders in notification messages
+_PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+
+@lru_cache(maxsize=256)
+def _split_message_template(message):
+    """
+    Split a notification message into literal text and placeholder names.
+    
+    Memoized on the message, so a template used for many documents is
+    scanned once. Even indexes of the returned tuple are literal text and
+    odd indexes are field names.
+    
+    Args:
+        message (str): Message containing "{fieldname}" placeholders
+        
+    Returns:
+        tuple: Alternating literal and field name parts
+    """
+    return tuple(_PLACEHOLDER_RE.split(message))
+
+def _render_message_template(parts, doc_fields):
+    """
+    Render a message split by _split_message_template.
+    
+    Args:
+        parts (tuple): Alternating literal and field name parts
+        doc_fields (dict): Field names mapped to string values
+        
+    Returns:
+        str: Message with known placeholders filled in; unknown ones are kept
+    """
+    rendered = list(parts)
+    for i in range(1, len(rendered), 2):
+        fieldname = rendered[i]
+        rendered[i] = doc_fields.get(fieldname, f"{{{fieldname}}}")
+    
+    return "".join(rendered)
+
+# Documents marshalled into a single bulk recommendation prompt; larger
+# batches make each response slower and less reliable to split
+_MAX_RECOMMENDATIONS_PER_PROMPT = 8
+
+# Documents accepted by one bulk recommendation request; every batch is a
+# synchronous Gemini call made while the web worker waits
+_MAX_BULK_RECOMMENDATION_ITEMS = 40
+
+# How long a recommendation for an unchanged document is served from cache
+_RECOMMENDATION_CACHE_TTL = 3600
 
 class WorkflowEngine:
     """
@@ -21,10 +93,30 @@ class WorkflowEngine:
     
     def __init__(self):
         """Initialize the workflow engine."""
-        self.settings = frappe.get_single("Gemini Assistant Settings")
-        self.client = GeminiClient()
-        self.prompt_builder = PromptBuilder()
-        self.response_parser = ResponseParser()
+        self.settings = frappe.get_cached_doc("Gemini Assistant Settings")
+        self._roles_by_user = {}
+        
+        # Field dicts of documents being processed by a document event,
+        # keyed by (doctype, name); see _get_event_document_fields
+        self._event_doc_fields = {}
+    
+    # The Gemini collaborators are built on first use. Document events and
+    # custom actions rarely need them, and GeminiClient() also reads and
+    # decrypts the API key, throwing if it is not configured
+    @cached_property
+    def client(self):
+        """GeminiClient used for AI recommendations."""
+        return GeminiClient()
+    
+    @cached_property
+    def prompt_builder(self):
+        """PromptBuilder used for AI recommendations."""
+        return PromptBuilder()
+    
+    @cached_property
+    def response_parser(self):
+        """ResponseParser used for AI recommendations."""
+        return ResponseParser()
     
     def process_document_event(self, doctype, docname, event, user=None):
         """
@@ -47,6 +139,9 @@ class WorkflowEngine:
             # Get document
             doc = frappe.get_doc(doctype, docname)
             
+            # Field dicts are only shared within a single event
+            self._event_doc_fields.clear()
+            
             # Get applicable workflows
             workflows = self._get_applicable_workflows(doctype, event)
             
@@ -111,7 +206,7 @@ class WorkflowEngine:
             frappe.log_error(f"Error executing custom action: {str(e)}")
             return {"success": False, "error": str(e)}
     
-    def get_ai_recommendation(self, doctype, docname, context=None):
+    def get_ai_recommendation(self, doctype, docname, context=None, stream=False):
         """
         Get AI recommendations for a document.
         
@@ -119,6 +214,8 @@ class WorkflowEngine:
             doctype (str): DocType of the document
             docname (str): Name of the document
             context (dict, optional): Additional context
+            stream (bool, optional): Publish the recommendation to the user as
+                "gemini_recommendation_chunk" realtime events while it is generated
             
         Returns:
             dict: AI recommendations
@@ -139,14 +236,31 @@ class WorkflowEngine:
             context["docname"] = docname
             
             # Add document fields
-            doc_fields = {}
-            for field in doc.meta.fields:
-                if hasattr(doc, field.fieldname):
-                    value = doc.get(field.fieldname)
-                    if value is not None:
-                        doc_fields[field.fieldname] = str(value)
+            context["document_data"] = self._get_document_fields(doc)
+            
+            # The key hashes the full context, document data included, so any
+            # edit to the document misses the cache instead of serving a stale
+            # recommendation
+            context_hash = hashlib.sha1(json.dumps(context, sort_keys=True, default=str).encode()).hexdigest()
+            cache_key = f"gemini:recommendation:{frappe.session.user}:{doctype}:{docname}:{context_hash}"
+            
+            user = frappe.session.user
+            
+            def publish_chunk(chunk):
+                frappe.publish_realtime(
+                    event="gemini_recommendation_chunk",
+                    message={"doctype": doctype, "docname": docname, "text": chunk},
+                    user=user
+                )
             
-            context["document_data"] = doc_fields
+            cached = frappe.cache().get_value(cache_key)
+            if cached:
+                # Streaming callers listen for chunks, so send the cached text
+                # down the same path as a single chunk
+                if stream:
+                    publish_chunk(cached["recommendations"])
+                
+                return cached
             
             # Build prompt for recommendations
             prompt = self.prompt_builder.build_prompt(
@@ -157,7 +271,10 @@ class WorkflowEngine:
             )
             
             # Get AI response
-            response = self.client.generate_text(prompt)
+            if stream:
+                response = self.client.generate_text_stream(prompt, on_chunk=publish_chunk)
+            else:
+                response = self.client.generate_text(prompt)
             
             # Parse response
             parsed_response = self.response_parser.parse_text_response(response)
@@ -165,8 +282,17 @@ class WorkflowEngine:
             # Log the recommendation
             self._log_ai_recommendation(doctype, docname, parsed_response)
             
+            # Only good responses are cached, so one failed parse cannot pin an
+            # error to the document for the whole TTL. Cache hits cost no tokens
+            if parsed_response["success"]:
+                frappe.cache().set_value(
+                    cache_key,
+                    {"success": True, "recommendations": parsed_response["content"], "tokens_used": 0, "cached": True},
+                    expires_in_sec=_RECOMMENDATION_CACHE_TTL
+                )
+            
             return {
-                "success": True,
+                "success": parsed_response["success"],
                 "recommendations": parsed_response["content"],
                 "tokens_used": response.get("tokens_used", 0)
             }
@@ -175,6 +301,178 @@ class WorkflowEngine:
             frappe.log_error(f"Error getting AI recommendation: {str(e)}")
             return {"success": False, "error": str(e)}
     
+    def get_ai_recommendations_bulk(self, items, context=None):
+        """
+        Get AI recommendations for several documents.
+        
+        Documents are marshalled into one prompt per batch of up to
+        _MAX_RECOMMENDATIONS_PER_PROMPT, so N documents cost N / batch size
+        Gemini round-trips instead of N.
+        
+        Args:
+            items (list): List of dicts with "doctype" and "docname", at most
+                _MAX_BULK_RECOMMENDATION_ITEMS
+            context (dict, optional): Additional context shared by all documents
+            
+        Returns:
+            dict: Per-document recommendations in the order of items
+        """
+        try:
+            # Check if workflow automation is enabled
+            if not self.settings.enable_workflow_automation:
+                return {"success": False, "message": "Workflow automation is disabled"}
+            
+            # Validate items before any Gemini call is made
+            if not isinstance(items, list):
+                return {"success": False, "error": "Items must be a list"}
+            
+            if len(items) > _MAX_BULK_RECOMMENDATION_ITEMS:
+                return {
+                    "success": False,
+                    "error": f"At most {_MAX_BULK_RECOMMENDATION_ITEMS} documents can be processed per request"
+                }
+            
+            for index, item in enumerate(items):
+                if not isinstance(item, dict) or not item.get("doctype") or not item.get("docname"):
+                    return {
+                        "success": False,
+                        "error": f"Item {index} must be a dict with doctype and docname"
+                    }
+            
+            results = []
+            tokens_used = 0
+            
+            for start in range(0, len(items), _MAX_RECOMMENDATIONS_PER_PROMPT):
+                batch = items[start:start + _MAX_RECOMMENDATIONS_PER_PROMPT]
+                batch_results, batch_tokens = self._get_recommendation_batch(batch, context)
+                results.extend(batch_results)
+                tokens_used += batch_tokens
+            
+            return {
+                "success": True,
+                "results": results,
+                "tokens_used": tokens_used
+            }
+            
+        except Exception as e:
+            frappe.log_error(f"Error getting bulk AI recommendations: {str(e)}")
+            return {"success": False, "error": str(e)}
+    
+    def _get_recommendation_batch(self, batch, context=None):
+        """
+        Get recommendations for one batch of documents with a single prompt.
+        
+        Args:
+            batch (list): List of dicts with "doctype" and "docname"
+            context (dict, optional): Additional context
+            
+        Returns:
+            tuple: (list of per-document results, tokens used)
+        """
+        try:
+            # Results are filled in per item so they keep the order of batch
+            results = [None] * len(batch)
+            
+            # Marshal each readable document under a row id the response is
+            # keyed by; documents the user cannot read never reach the prompt
+            documents = []
+            for row_id, item in enumerate(batch):
+                if not frappe.has_permission(item["doctype"], "read", item["docname"]):
+                    results[row_id] = {
+                        "doctype": item["doctype"],
+                        "docname": item["docname"],
+                        "success": False,
+                        "error": "Permission denied"
+                    }
+                    continue
+                
+                doc = frappe.get_doc(item["doctype"], item["docname"])
+                documents.append({
+                    "id": str(row_id),
+                    "doctype": item["doctype"],
+                    "docname": item["docname"],
+                    "document_data": self._get_document_fields(doc)
+                })
+            
+            if not documents:
+                return results, 0
+            
+            prompt = self.prompt_builder.build_prompt(
+                user_input=(
+                    "Please provide recommendations for each of the following documents. "
+                    "Respond only with a JSON object that maps each document id to its recommendations.\n\n"
+                    f"{json.dumps(documents)}"
+                ),
+                context=context
+            )
+            
+            # Get AI response
+            response = self.client.generate_text(prompt)
+            
+            # Split the response back out by row id
+            parsed = self.response_parser.extract_structured_data(response, expected_format="json")
+            recommendations = parsed["data"] if parsed.get("format") == "json" and isinstance(parsed["data"], dict) else {}
+            
+            for document in documents:
+                row_id = int(document["id"])
+                recommendation = recommendations.get(document["id"])
+                
+                if recommendation is None:
+                    results[row_id] = {
+                        "doctype": document["doctype"],
+                        "docname": document["docname"],
+                        "success": False,
+                        "error": "No recommendation returned for this document"
+                    }
+                    continue
+                
+                # Log the recommendation
+                self._log_ai_recommendation(document["doctype"], document["docname"], {"content": str(recommendation)})
+                
+                results[row_id] = {
+                    "doctype": document["doctype"],
+                    "docname": document["docname"],
+                    "success": True,
+                    "recommendations": recommendation
+                }
+            
+            return results, response.get("tokens_used", 0)
+            
+        except Exception as e:
+            frappe.log_error(f"Error getting AI recommendation batch: {str(e)}")
+            return [
+                {
+                    "doctype": item.get("doctype"),
+                    "docname": item.get("docname"),
+                    "success": False,
+                    "error": str(e)
+                }
+                for item in batch
+            ], 0
+    
+    def _get_document_fields(self, doc):
+        """
+        Get the non-empty field values of a document as strings.
+        
+        Args:
+            doc (object): Document object
+            
+        Returns:
+            dict: Field names mapped to string values
+        """
+        # Only the doctype's own fields; child tables are left out so their
+        # rows are not sent to Gemini or used as notification placeholders
+        doc_fields = {}
+        for field in doc.meta.fields:
+            if field.fieldtype in table_fields:
+                continue
+            
+            value = doc.get(field.fieldname)
+            if value is not None:
+                doc_fields[field.fieldname] = str(value)
+        
+        return doc_fields
+    
     def _get_applicable_workflows(self, doctype, event):
         """
         Get workflows applicable to a doctype and event.
@@ -220,49 +518,31 @@ class WorkflowEngine:
         try:
             results = []
             
-            # Execute each action in the workflow
+            # update_field actions only set values. A run of them is saved
+            # once, before the next other action, so later actions see saved
+            # state and a failure there cannot drop the updates
+            pending_save = False
+            
+            # Execute each action in the workflow; unknown types are skipped
             for action in workflow.get("actions", []):
                 action_type = action.get("type")
+                handler = self._WORKFLOW_ACTION_HANDLERS.get(action_type)
+                if handler is None:
+                    continue
                 
-                if action_type == "notification":
-                    # Send notification
-                    result = self._send_notification(
-                        recipients=action.get("recipients", []),
-                        subject=action.get("subject", ""),
-                        message=action.get("message", ""),
-                        doc=doc
-                    )
-                    results.append({"type": "notification", "result": result})
+                if pending_save and action_type != "update_field":
+                    doc.save()
+                    pending_save = False
                 
-                elif action_type == "update_field":
-                    # Update document field
-                    field = action.get("field")
-                    value = action.get("value")
+                result = handler(self, action, doc, user)
+                if result is not None:
+                    results.append(result)
                     
-                    if field and hasattr(doc, field):
-                        doc.set(field, value)
-                        doc.save()
-                        results.append({"type": "update_field", "field": field, "value": value})
-                
-                elif action_type == "create_document":
-                    # Create new document
-                    new_doctype = action.get("doctype")
-                    fields = action.get("fields", {})
-                    
-                    new_doc = frappe.new_doc(new_doctype)
-                    for field, value in fields.items():
-                        new_doc.set(field, value)
-                    
-                    new_doc.insert()
-                    results.append({"type": "create_document", "doctype": new_doctype, "name": new_doc.name})
-                
-                elif action_type == "custom_action":
-                    # Execute custom action
-                    action_name = action.get("action_name")
-                    params = action.get("params", {})
-                    
-                    result = self.execute_custom_action(action_name, params, user)
-                    results.append({"type": "custom_action", "action": action_name, "result": result})
+                    if action_type == "update_field":
+                        pending_save = True
+            
+            if pending_save:
+                doc.save()
             
             return {
                 "workflow": workflow.get("name"),
@@ -279,6 +559,75 @@ class WorkflowEngine:
                 "error": str(e)
             }
     
+    def _get_event_document_fields(self, doc):
+        """
+        Get a document's field dict, built once per document event.
+        
+        Every notification action of every workflow for an event reads the
+        same document, so the dict is built on first use and reused.
+        _run_update_field_action drops the entry when it changes a value.
+        
+        Args:
+            doc (object): Document object
+            
+        Returns:
+            dict: Field names mapped to string values
+        """
+        key = (doc.doctype, doc.name)
+        doc_fields = self._event_doc_fields.get(key)
+        if doc_fields is None:
+            doc_fields = self._event_doc_fields[key] = self._get_document_fields(doc)
+        
+        return doc_fields
+    
+    def _run_notification_action(self, action, doc, user=None):
+        """Run a workflow "notification" action."""
+        result = self._send_notification(
+            recipients=action.get("recipients", []),
+            subject=action.get("subject", ""),
+            message=action.get("message", ""),
+            doc=doc
+        )
+        return {"type": "notification", "result": result}
+    
+    def _run_update_field_action(self, action, doc, user=None):
+        """Run a workflow "update_field" action. The caller saves the document."""
+        field = action.get("field")
+        value = action.get("value")
+        
+        if field and hasattr(doc, field):
+            doc.set(field, value)
+            self._event_doc_fields.pop((doc.doctype, doc.name), None)
+            return {"type": "update_field", "field": field, "value": value}
+    
+    def _run_create_document_action(self, action, doc, user=None):
+        """Run a workflow "create_document" action."""
+        new_doctype = action.get("doctype")
+        fields = action.get("fields", {})
+        
+        new_doc = frappe.new_doc(new_doctype)
+        for field, value in fields.items():
+            new_doc.set(field, value)
+        
+        new_doc.insert()
+        return {"type": "create_document", "doctype": new_doctype, "name": new_doc.name}
+    
+    def _run_custom_action(self, action, doc, user=None):
+        """Run a workflow "custom_action" action."""
+        action_name = action.get("action_name")
+        params = action.get("params", {})
+        
+        result = self.execute_custom_action(action_name, params, user)
+        return {"type": "custom_action", "action": action_name, "result": result}
+    
+    # Workflow action type -> handler, called as handler(self, action, doc, user)
+    _WORKFLOW_ACTION_HANDLERS = {
+        "notification": _run_notification_action,
+        "update_field": _run_update_field_action,
+        "create_document": _run_create_document_action,
+        "custom_action": _run_custom_action
+    }
+    
     def _get_action_definition(self, action_name):
         """
         Get the definition of a custom action.
@@ -290,23 +639,8 @@ class WorkflowEngine:
             dict: Action definition
         """
         # This would typically query a custom DocType for action definitions
-        # For now, we'll return a hardcoded example
-        actions = {
-            "send_email": {
-                "name": "send_email",
-                "description": "Send an email to specified recipients",
-                "allowed_roles": ["System Manager", "Administrator"],
-                "parameters": ["recipients", "subject", "message"]
-            },
-            "create_task": {
-                "name": "create_task",
-                "description": "Create a new task",
-                "allowed_roles": ["System Manager", "Administrator"],
-                "parameters": ["subject", "description", "assigned_to"]
-            }
-        }
-        
-        return actions.get(action_name)
+        # For now, they are a module-level constant built once per process
+        return _ACTION_DEFINITIONS.get(action_name)
     
     def _check_action_permissions(self, action, user):
         """
@@ -319,17 +653,16 @@ class WorkflowEngine:
         Returns:
             bool: True if user has permission
         """
-        # Get user roles
-        user_roles = frappe.get_roles(user)
+        # Get user roles, once per user for the life of this engine
+        user_roles = self._roles_by_user.get(user)
+        if user_roles is None:
+            user_roles = self._roles_by_user[user] = frozenset(frappe.get_roles(user))
         
         # Check if user has any of the allowed roles
-        allowed_roles = action.get("allowed_roles", [])
+        if "Administrator" in user_roles:
+            return True
         
-        for role in user_roles:
-            if role in allowed_roles or role == "Administrator":
-                return True
-        
-        return False
+        return not user_roles.isdisjoint(action.get("allowed_roles", ()))
     
     def _execute_action(self, action, params):
         """
@@ -376,20 +709,23 @@ class WorkflowEngine:
             dict: Result of notification sending
         """
         try:
-            # Replace placeholders in message
-            if doc:
-                for field in doc.meta.fields:
-                    if hasattr(doc, field.fieldname):
-                        value = doc.get(field.fieldname)
-                        if value is not None:
-                            placeholder = f"{{{field.fieldname}}}"
-                            message = message.replace(placeholder, str(value))
+            # Replace placeholders in message from its cached split; unknown
+            # placeholders are left as they are
+            if doc and "{" in message:
+                parts = _split_message_template(message)
+                if len(parts) > 1:
+                    message = _render_message_template(parts, self._get_event_document_fields(doc))
+            
+            # Build the script once; json.dumps yields a properly escaped JS
+            # string literal, so quotes or backslashes in the message can no
+            # longer break out of it
+            script = f'frappe.show_alert({{message: {json.dumps(message)}, indicator: "blue"}});'
             
             # Send notification to each recipient
             for user in recipients:
                 frappe.publish_realtime(
                     event="eval_js",
-                    message=f'frappe.show_alert({{message: "{message}", indicator: "blue"}});',
+                    message=script,
                     user=user
                 )
             
@@ -463,25 +799,14 @@ class WorkflowEngine:
             results (list): Results of workflow execution
         """
         try:
-            audit_log = frappe.get_doc({
-                "doctype": "Gemini Audit Log",
-                "timestamp": now_datetime(),
-                "user": frappe.session.user,
-                "action_type": "Workflow",
-                "details": json.dumps({
-                    "doctype": doctype,
-                    "docname": docname,
-                    "event": event,
-                    "workflows_executed": len(results),
-                    "timestamp": str(now_datetime())
-                }),
-                "status": "Success",
-                "ip_address": frappe.local.request_ip if hasattr(frappe.local, "request_ip") else "127.0.0.1"
+            enqueue_audit_log("Workflow", {
+                "doctype": doctype,
+                "docname": docname,
+                "event": event,
+                "workflows_executed": len(results),
+                "timestamp": str(now_datetime())
             })
             
-            audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
-            
         except Exception as e:
             frappe.log_error(f"Error logging workflow execution: {str(e)}")
     
@@ -496,28 +821,14 @@ class WorkflowEngine:
         """
         try:
             # Create a safe copy of params without sensitive data
-            safe_params = {}
-            for key, value in (params or {}).items():
-                if key not in ["password", "api_key", "token"]:
-                    safe_params[key] = value
-            
-            audit_log = frappe.get_doc({
-                "doctype": "Gemini Audit Log",
-                "timestamp": now_datetime(),
-                "user": frappe.session.user,
-                "action_type": "Custom Action",
-                "details": json.dumps({
-                    "action": action_name,
-                    "params": safe_params,
-                    "success": result.get("success", False),
-                    "timestamp": str(now_datetime())
-                }),
-                "status": "Success" if result.get("success") else "Error",
-                "ip_address": frappe.local.request_ip if hasattr(frappe.local, "request_ip") else "127.0.0.1"
-            })
+            safe_params = {k: v for k, v in (params or {}).items() if k not in SENSITIVE_KEYS}
             
-            audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
+            enqueue_audit_log("Custom Action", {
+                "action": action_name,
+                "params": safe_params,
+                "success": result.get("success", False),
+                "timestamp": str(now_datetime())
+            }, status="Success" if result.get("success") else "Error")
             
         except Exception as e:
             frappe.log_error(f"Error logging action execution: {str(e)}")
@@ -532,23 +843,12 @@ class WorkflowEngine:
             recommendation (dict): AI recommendation
         """
         try:
-            audit_log = frappe.get_doc({
-                "doctype": "Gemini Audit Log",
-                "timestamp": now_datetime(),
-                "user": frappe.session.user,
-                "action_type": "AI Recommendation",
-                "details": json.dumps({
-                    "doctype": doctype,
-                    "docname": docname,
-                    "recommendation_length": len(recommendation.get("content", "")),
-                    "timestamp": str(now_datetime())
-                }),
-                "status": "Success",
-                "ip_address": frappe.local.request_ip if hasattr(frappe.local, "request_ip") else "127.0.0.1"
+            enqueue_audit_log("AI Recommendation", {
+                "doctype": doctype,
+                "docname": docname,
+                "recommendation_length": len(recommendation.get("content", "")),
+                "timestamp": str(now_datetime())
             })
             
-            audit_log.insert(ignore_permissions=True)
-            frappe.db.commit()
-            
         except Exception as e:
             frappe.log_error(f"Error logging AI recommendation: {str(e)}")